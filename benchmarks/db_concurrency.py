@@ -0,0 +1,74 @@
+# benchmarks/db_concurrency.py
+"""Compare DatabaseManager under mixed read/write load with and without WAL readers.
+
+Queries go through aexecute_query, not the account registry, so every
+read and write is served by SQLite.
+
+Run from the repository root:
+    python benchmarks/db_concurrency.py [accounts] [seconds]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database_manager import ACCOUNT_COLUMNS, HOT_QUERIES, DatabaseManager
+
+def seed(db_manager, count):
+    conn, cursor = db_manager.get_connection()
+    cursor.executemany(
+        "INSERT INTO accounts (api_id, api_hash, phone, twofa, user_id, username, name) VALUES (?,?,?,?,?,?,?)",
+        [(100000 + i, f"hash{i}", f"+62800{i:07d}", None, i, f"user{i}", f"Akun {i}") for i in range(count)]
+    )
+    conn.commit()
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000 if samples else 0
+
+async def reader(db_manager, count, deadline, latencies, scan_ratio):
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        if rng.random() < scan_ratio:
+            await db_manager.aexecute_query(f"SELECT {ACCOUNT_COLUMNS} FROM accounts", fetch_all=True)
+        else:
+            await db_manager.aexecute_query(f"SELECT {ACCOUNT_COLUMNS} FROM accounts WHERE api_id=?",
+                                            (100000 + rng.randrange(count),), fetch_all=True)
+        latencies.append(time.perf_counter() - started)
+
+async def writer(db_manager, count, deadline, latencies):
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        i = rng.randrange(count)
+        started = time.perf_counter()
+        await db_manager.aexecute_query(HOT_QUERIES['update_account'],
+                                        (i, f"user{i}_{rng.randrange(1000)}", f"Akun {i}", 100000 + i), commit=True)
+        latencies.append(time.perf_counter() - started)
+
+async def workload(db_manager, count, seconds, scan_ratio, readers=16, writers=4):
+    reads, writes = [], []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[reader(db_manager, count, deadline, reads, scan_ratio) for _ in range(readers)],
+                         *[writer(db_manager, count, deadline, writes) for _ in range(writers)])
+    return reads, writes
+
+def run(count, seconds):
+    # Indexed lookups only, then with 5% full-table reads, which hold the GIL for every fetched row
+    print(f"{'scans':>6} {'readers':>8} {'reads/s':>9} {'writes/s':>9} {'read p95 ms':>12} {'write p95 ms':>13}")
+    for scan_ratio in (0, 0.05):
+        for readers in (0, 4):
+            with tempfile.TemporaryDirectory() as directory:
+                db_manager = DatabaseManager(os.path.join(directory, 'accounts.db'), readers=readers)
+                seed(db_manager, count)
+                reads, writes = asyncio.run(workload(db_manager, count, seconds, scan_ratio))
+                db_manager.close()
+            print(f"{scan_ratio:>6.0%} {readers:>8} {len(reads) / seconds:>9.0f} {len(writes) / seconds:>9.0f} "
+                  f"{percentile(reads, 0.95):>12.2f} {percentile(writes, 0.95):>13.2f}")
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, float(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,121 @@
+# benchmarks/rule_matching.py
+"""Compare rule matching time of the compiled snapshot against per-rule loops.
+
+The contains workload is timed against the original substring loop; the
+typed workloads against a loop over rules precompiled one by one.
+
+Run from the repository root:
+    python benchmarks/rule_matching.py [rule counts...]
+"""
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rules.snapshot import RuleSnapshot
+
+WORDS = [''.join(random.Random(i).choices(string.ascii_lowercase, k=random.Random(i).randint(4, 9)))
+         for i in range(5000)]
+
+# Workload name -> the match types its rules are drawn from
+WORKLOADS = {'contains': ['contains'], 'regex': ['regex'], 'mixed': ['contains', 'word', 'prefix', 'exact', 'regex']}
+
+def make_rules(count, match_types, seed=1):
+    rng = random.Random(seed)
+    rules = {}
+    for i in range(count):
+        match_type = rng.choice(match_types)
+        keyword = f"{rng.choice(WORDS)}{i}"
+        if match_type == 'regex':
+            keyword = f"{keyword}\\d+"
+        rules[str(i + 1)] = {'keyword': keyword, 'responses': ['ok'], 'private_only': rng.random() < 0.3,
+                             'match_type': match_type}
+    return rules
+
+def make_messages(rules, count=2000, hit_ratio=0.1, seed=2):
+    rng = random.Random(seed)
+    keywords = [rule['keyword'].replace('\\d+', '42') for rule in rules.values()]
+    messages = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(5, 30))
+        if keywords and rng.random() < hit_ratio:
+            words.insert(rng.randint(0, len(words)), rng.choice(keywords))
+        messages.append(' '.join(words))
+    return messages
+
+def legacy_substring_loop(rules, message_text, is_private):
+    """The original MessageHandler loop: one lowercase substring test per rule"""
+    for rule_id, rule in rules.items():
+        if rule.get('private_only', False) and not is_private:
+            continue
+        if rule['keyword'].lower() in message_text.lower():
+            return rule_id
+    return None
+
+def compile_per_rule(rules):
+    """Precompile each rule on its own, as typed rules would be without combining"""
+    compiled = []
+    for rule_id, rule in rules.items():
+        keyword = rule['keyword']
+        match_type = rule.get('match_type', 'contains')
+        if match_type == 'regex':
+            test = re.compile(keyword, re.IGNORECASE).search
+        elif match_type == 'word':
+            test = re.compile(r'(?<!\w)' + re.escape(keyword.casefold()) + r'(?!\w)').search
+        else:
+            test = keyword.casefold()
+        compiled.append((rule_id, rule.get('private_only', False), match_type, test))
+    return compiled
+
+def per_rule_loop(compiled, message_text, is_private):
+    """One test or precompiled pattern search per rule"""
+    text = message_text.casefold()
+    for rule_id, private_only, match_type, test in compiled:
+        if private_only and not is_private:
+            continue
+        if match_type == 'regex':
+            hit = test(message_text)
+        elif match_type == 'word':
+            hit = test(text)
+        elif match_type == 'prefix':
+            hit = text.lstrip().startswith(test)
+        elif match_type == 'exact':
+            hit = text.strip() == test.strip()
+        else:
+            hit = test in text
+        if hit:
+            return rule_id
+    return None
+
+def timed(func, messages):
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        func(message, i % 2 == 0)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+def run(rule_counts):
+    print(f"{'rules':>7} {'types':>9} {'loop us/msg':>12} {'snapshot us/msg':>16} {'speedup':>8}")
+    for count in rule_counts:
+        for workload, match_types in WORKLOADS.items():
+            rules = make_rules(count, match_types)
+            messages = make_messages(rules)
+            snapshot = RuleSnapshot(rules)
+            if workload == 'contains':
+                loop = lambda message, is_private: legacy_substring_loop(rules, message, is_private)
+            else:
+                compiled = compile_per_rule(rules)
+                loop = lambda message, is_private: per_rule_loop(compiled, message, is_private)
+            for i, message in enumerate(messages[:200]):
+                expected = loop(message, i % 2 == 0)
+                found = snapshot.match(message, i % 2 == 0)
+                assert (found.rule_id if found else None) == expected, message
+            loop_us = timed(loop, messages)
+            snapshot_us = timed(snapshot.match, messages)
+            print(f"{count:>7} {workload:>9} {loop_us:>12.1f} {snapshot_us:>16.1f} {loop_us / snapshot_us:>7.1f}x")
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 3000])
@@ -0,0 +1,88 @@
+# db/account_registry.py
+import threading
+
+# Column positions of an account row, in the order get_all_accounts returns them
+API_ID, API_HASH, PHONE, TWOFA, USER_ID, USERNAME, NAME = range(7)
+
+def _as_key(value):
+    # SQLite compares '123' and 123 equal on an INTEGER column, so the indexes do too
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def _username_key(username):
+    # Telegram usernames are case-insensitive and often typed with '@'
+    return username.lstrip('@').casefold() if username else None
+
+class AccountRegistry:
+    # In-memory accounts table kept current write-through; shared api_ids and user_ids map to lists of phones
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.by_phone = {}
+        self.by_api_id = {}
+        self.by_user_id = {}
+        self.by_username = {}
+    def load(self, rows):
+        with self.lock:
+            self.by_phone, self.by_api_id, self.by_user_id, self.by_username = {}, {}, {}, {}
+            for row in rows:
+                self._put(tuple(row))
+            self.loaded = True
+    def invalidate(self):
+        with self.lock:
+            self.loaded = False
+    def _index(self, index, key, phone):
+        if key is None:
+            return
+        phones = index.setdefault(_as_key(key), [])
+        if phone not in phones:
+            phones.append(phone)
+    def _unindex(self, index, key, phone):
+        key = _as_key(key)
+        phones = index.get(key)
+        if phones and phone in phones:
+            phones.remove(phone)
+            if not phones:
+                del index[key]
+    def _put(self, row):
+        old = self.by_phone.get(row[PHONE])
+        if old is not None:
+            self._unindex(self.by_api_id, old[API_ID], old[PHONE])
+            self._unindex(self.by_user_id, old[USER_ID], old[PHONE])
+            self._unindex(self.by_username, _username_key(old[USERNAME]), old[PHONE])
+        self.by_phone[row[PHONE]] = row
+        self._index(self.by_api_id, row[API_ID], row[PHONE])
+        self._index(self.by_user_id, row[USER_ID], row[PHONE])
+        self._index(self.by_username, _username_key(row[USERNAME]), row[PHONE])
+    def put(self, row):
+        with self.lock:
+            self._put(tuple(row))
+    def remove(self, phone):
+        with self.lock:
+            row = self.by_phone.pop(phone, None)
+            if row is not None:
+                self._unindex(self.by_api_id, row[API_ID], phone)
+                self._unindex(self.by_user_id, row[USER_ID], phone)
+                self._unindex(self.by_username, _username_key(row[USERNAME]), phone)
+            return row
+    def remove_by_api_id(self, api_id):
+        with self.lock:
+            return [self.remove(row[PHONE]) for row in self.find_by_api_id(api_id)]
+    def all(self):
+        with self.lock:
+            return list(self.by_phone.values())
+    def count(self):
+        return len(self.by_phone)
+    def get(self, phone):
+        return self.by_phone.get(phone)
+    def find_by_api_id(self, api_id):
+        with self.lock:
+            return [self.by_phone[phone] for phone in self.by_api_id.get(_as_key(api_id), ())]
+    def find_by_user_id(self, user_id):
+        with self.lock:
+            return [self.by_phone[phone] for phone in self.by_user_id.get(_as_key(user_id), ())]
+    def find_by_username(self, username):
+        with self.lock:
+            return [self.by_phone[phone] for phone in self.by_username.get(_username_key(username), ())]
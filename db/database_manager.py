@@ -3,13 +3,46 @@ import os
 import sqlite3
 import logging
 import time
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .account_registry import AccountRegistry
+
+# WAL reader connections; 0 sends reads through the writer connection as before. Account
+# reads are served by the registry, and benchmarks/db_concurrency.py shows no gain from readers
+DEFAULT_READERS = 0
+# Phones per existence lookup in a bulk upsert, below SQLite's bound parameter limit
+UPSERT_LOOKUP_CHUNK = 500
+# Bumped by every schema upgrade in _upgrade_schema, stored in PRAGMA user_version
+SCHEMA_VERSION = 1
+ACCOUNT_COLUMNS = "api_id, api_hash, phone, twofa, user_id, username, name"
+# Statements that run against SQLite on every call; none of them may scan the whole table
+HOT_QUERIES = {
+    'update_account': "UPDATE accounts SET user_id=?, username=?, name=? WHERE api_id=?",
+    'update_twofa': "UPDATE accounts SET twofa=? WHERE api_id=?",
+    'delete_account': "DELETE FROM accounts WHERE api_id=?",
+    # Run with one placeholder per phone of an UPSERT_LOOKUP_CHUNK
+    'upsert_lookup': "SELECT phone FROM accounts WHERE phone IN ({placeholders})",
+}
 
 class DatabaseManager:
-    def __init__(self, db_path='accounts/accounts.db'):
+    def __init__(self, db_path='accounts/accounts.db', readers=DEFAULT_READERS):
         self.db_path = db_path
         self._setup_folders()
         self.conn = None
         self.cursor = None
+        self.reader_count = readers
+        self._readers = queue.Queue()
+        self._reader_conns = []
+        # Writes are serialized on one thread and connection; reads run in parallel on
+        # their own WAL connections, and neither ever runs on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database-writer')
+        self._reader_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='database-reader') if readers else None
+        self._lock = threading.RLock()
+        # Loaded on first read, then kept current write-through by every account write
+        self.accounts = AccountRegistry()
         self._setup_database()
     
     def _setup_folders(self):
@@ -21,8 +54,11 @@ class DatabaseManager:
         for attempt in range(max_retries):
             try:
                 self._close_connection()
-                self.conn = sqlite3.connect(self.db_path)
+                self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
                 self.cursor = self.conn.cursor()
+                # WAL lets the readers see committed data while the writer works
+                self.cursor.execute("PRAGMA journal_mode=WAL")
+                self.cursor.execute("PRAGMA synchronous=NORMAL")
                 
                 # Cek apakah tabel sudah ada
                 self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='accounts'")
@@ -63,7 +99,10 @@ class DatabaseManager:
                         self.cursor.execute("DROP TABLE accounts_old")
                         logging.info("Database berhasil dimigrasi ke struktur baru")
                 
+                self._upgrade_schema()
                 self.conn.commit()
+                self.accounts.invalidate()
+                self._open_readers()
                 logging.debug("Database connection established successfully")
                 return
             except sqlite3.Error as e:
@@ -75,7 +114,34 @@ class DatabaseManager:
                     logging.critical("Failed to connect to database after multiple attempts")
                     raise
     
+    def _upgrade_schema(self):
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # api_id backs update and delete; phone is indexed by its UNIQUE constraint, and
+            # lookups by user_id and username are answered by the account registry
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_api_id ON accounts (api_id)")
+        if version < SCHEMA_VERSION:
+            self.cursor.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            logging.info(f"Database schema upgraded from version {version} to {SCHEMA_VERSION}")
+    
+    def _open_readers(self):
+        for _ in range(self.reader_count - len(self._reader_conns)):
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA query_only=ON")
+            self._reader_conns.append(conn)
+            self._readers.put(conn)
+    
+    def _close_readers(self):
+        while self._reader_conns:
+            conn = self._reader_conns.pop()
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error closing database reader connection: {str(e)}")
+        self._readers = queue.Queue()
+    
     def _close_connection(self):
+        self._close_readers()
         if self.conn:
             try:
                 self.conn.close()
@@ -90,65 +156,311 @@ class DatabaseManager:
             self._setup_database()
         return self.conn, self.cursor
     
-    def execute_query(self, query, params=(), fetch_all=False, commit=False):
+    def _is_read(self, query, commit):
+        if commit or not self._reader_conns:
+            return False
+        statement = query.lstrip()[:6].upper()
+        return statement == "SELECT" or (statement == "PRAGMA" and "=" not in query)
+    
+    def _execute_once(self, query, params=(), fetch_all=False, commit=False):
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            cursor = self.conn.cursor()
+            cursor.execute(query, params)
+            if commit:
+                self.conn.commit()
+                # Raw writes cannot be mirrored row by row; the registry reloads on next read
+                if "accounts" in query.lower():
+                    self.accounts.invalidate()
+            if fetch_all:
+                return cursor.fetchall()
+            return True
+    
+    def _read_once(self, query, params=(), fetch_all=False):
+        # Each reader connection is used by one thread at a time, with its own cursor
+        conn = self._readers.get()
+        try:
+            cursor = conn.execute(query, params)
+            if fetch_all:
+                return cursor.fetchall()
+            return True
+        finally:
+            self._readers.put(conn)
+    
+    def _retry(self, func, *args):
         max_retries = 3
         retry_delay = 1
         for attempt in range(max_retries):
             try:
-                if not self.conn:
-                    self._setup_database()
-                self.cursor.execute(query, params)
-                if commit:
-                    self.conn.commit()
-                if fetch_all:
-                    return self.cursor.fetchall()
-                return True
+                return func(*args)
             except sqlite3.Error as e:
                 logging.error(f"Database query error (attempt {attempt+1}/{max_retries}): {str(e)}")
                 if "database is locked" in str(e) and attempt < max_retries - 1:
                     time.sleep(retry_delay)
                     retry_delay *= 2
-                    self._setup_database()
                 else:
                     logging.error("Failed to execute query after retries")
                     raise
         return False
     
+    async def _aretry(self, func, *args, executor=None):
+        # Run func on a database thread; lock retries back off without blocking the loop
+        loop = asyncio.get_running_loop()
+        max_retries = 3
+        retry_delay = 1
+        for attempt in range(max_retries):
+            try:
+                return await loop.run_in_executor(executor or self._executor, func, *args)
+            except sqlite3.Error as e:
+                logging.error(f"Database query error (attempt {attempt+1}/{max_retries}): {str(e)}")
+                if "database is locked" in str(e) and attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                else:
+                    logging.error("Failed to execute query after retries")
+                    raise
+        return False
+    
+    def execute_query(self, query, params=(), fetch_all=False, commit=False):
+        if self._is_read(query, commit):
+            return self._retry(self._read_once, query, params, fetch_all)
+        return self._retry(self._execute_once, query, params, fetch_all, commit)
+    
+    async def aexecute_query(self, query, params=(), fetch_all=False, commit=False):
+        if self._is_read(query, commit):
+            return await self._aretry(self._read_once, query, params, fetch_all, executor=self._reader_executor)
+        return await self._aretry(self._execute_once, query, params, fetch_all, commit)
+    
+    def _load_accounts_once(self):
+        # Loaded on the writer connection under the lock, so no write-through can slip in between
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            if not self.accounts.loaded:
+                rows = self.conn.execute(f"SELECT {ACCOUNT_COLUMNS} FROM accounts ORDER BY id").fetchall()
+                self.accounts.load(rows)
+                logging.debug(f"Account registry loaded with {len(rows)} accounts")
+            return self.accounts
+    
+    def _registry(self):
+        if self.accounts.loaded:
+            return self.accounts
+        return self._retry(self._load_accounts_once)
+    
+    async def _aregistry(self):
+        if self.accounts.loaded:
+            return self.accounts
+        return await self._aretry(self._load_accounts_once)
+    
     def get_all_accounts(self):
-        return self.execute_query("SELECT api_id, api_hash, phone, twofa, user_id, username, name FROM accounts", fetch_all=True)
+        return self._registry().all()
     
     def get_account_by_api_id(self, api_id):
-        accounts = self.execute_query("SELECT api_id, api_hash, phone, twofa, user_id, username, name FROM accounts WHERE api_id=?", (api_id,), fetch_all=True)
+        accounts = self._registry().find_by_api_id(api_id)
         return accounts[0] if accounts else None
     
-    def add_account(self, api_id, api_hash, phone, twofa, user_id, username, name):
-        try:
-            result = self.execute_query(
+    def get_account_by_phone(self, phone):
+        return self._registry().get(phone)
+    
+    def get_account_by_user_id(self, user_id):
+        accounts = self._registry().find_by_user_id(user_id)
+        return accounts[0] if accounts else None
+    
+    def get_account_by_username(self, username):
+        accounts = self._registry().find_by_username(username)
+        return accounts[0] if accounts else None
+    
+    def _add_account_once(self, api_id, api_hash, phone, twofa, user_id, username, name):
+        # A cursor of its own, so no other query can change rowcount in between
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            cursor = self.conn.cursor()
+            cursor.execute(
                 "INSERT OR IGNORE INTO accounts (api_id, api_hash, phone, twofa, user_id, username, name) VALUES (?,?,?,?,?,?,?)",
-                (api_id, api_hash, phone, twofa, user_id, username, name),
-                commit=True
+                (api_id, api_hash, phone, twofa, user_id, username, name)
             )
-            if self.cursor.rowcount == 0:
-                result = self.execute_query(
+            if cursor.rowcount == 0:
+                cursor.execute(
                     "UPDATE accounts SET api_id=?, api_hash=?, twofa=?, user_id=?, username=?, name=? WHERE phone=?",
-                    (api_id, api_hash, twofa, user_id, username, name, phone),
-                    commit=True
+                    (api_id, api_hash, twofa, user_id, username, name, phone)
                 )
-            return result
+            self.conn.commit()
+            self._refresh_accounts("phone", [phone])
+            return True
+    
+    def add_account(self, api_id, api_hash, phone, twofa, user_id, username, name):
+        try:
+            return self._retry(self._add_account_once, api_id, api_hash, phone, twofa, user_id, username, name)
+        except sqlite3.IntegrityError as e:
+            logging.warning(f"Constraint violation adding account {phone}: {str(e)}")
+            return False
+    
+    async def aadd_account(self, api_id, api_hash, phone, twofa, user_id, username, name):
+        try:
+            return await self._aretry(self._add_account_once, api_id, api_hash, phone, twofa, user_id, username, name)
         except sqlite3.IntegrityError as e:
             logging.warning(f"Constraint violation adding account {phone}: {str(e)}")
             return False
     
+    def _upsert_accounts_once(self, rows):
+        # One transaction for the whole batch; rows that existed before are reported as updated
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                phones = list({row[2] for row in rows})
+                existing = set()
+                for start in range(0, len(phones), UPSERT_LOOKUP_CHUNK):
+                    chunk = phones[start:start + UPSERT_LOOKUP_CHUNK]
+                    cursor.execute(HOT_QUERIES['upsert_lookup'].format(placeholders=', '.join('?' * len(chunk))), chunk)
+                    existing.update(phone for phone, in cursor.fetchall())
+                cursor.executemany(
+                    "INSERT INTO accounts (api_id, api_hash, phone, twofa, user_id, username, name) VALUES (?,?,?,?,?,?,?) "
+                    "ON CONFLICT(phone) DO UPDATE SET api_id=excluded.api_id, api_hash=excluded.api_hash, "
+                    "twofa=excluded.twofa, user_id=excluded.user_id, username=excluded.username, name=excluded.name",
+                    rows
+                )
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            self._refresh_accounts("phone", phones)
+            outcomes = []
+            for row in rows:
+                outcomes.append((row[2], 'updated' if row[2] in existing else 'inserted'))
+                existing.add(row[2])
+            return outcomes
+    
+    def _valid_upsert_rows(self, rows):
+        # Rows without api_id or phone never reach sqlite, where NOT NULL would fail the whole batch
+        return [tuple(row) for row in rows if row[0] is not None and row[2]]
+    
+    def _order_outcomes(self, rows, outcomes):
+        outcomes = iter(outcomes)
+        return [(row[2], 'failed') if row[0] is None or not row[2] else next(outcomes) for row in rows]
+    
+    def upsert_accounts(self, rows):
+        # One transaction; returns [(phone, 'inserted' | 'updated' | 'failed')] in input order
+        valid = self._valid_upsert_rows(rows)
+        outcomes = self._retry(self._upsert_accounts_once, valid) if valid else []
+        return self._order_outcomes(rows, outcomes)
+    
+    async def aupsert_accounts(self, rows):
+        valid = self._valid_upsert_rows(rows)
+        outcomes = await self._aretry(self._upsert_accounts_once, valid) if valid else []
+        return self._order_outcomes(rows, outcomes)
+    
+    def _refresh_accounts(self, column, values):
+        # Written rows are re-read so the registry holds what SQLite stored ('777' comes back as 777)
+        values = list(values)
+        for start in range(0, len(values), UPSERT_LOOKUP_CHUNK):
+            chunk = values[start:start + UPSERT_LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                f"SELECT {ACCOUNT_COLUMNS} FROM accounts WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for row in rows:
+                self.accounts.put(row)
+    
+    def _write_accounts_once(self, query, params, api_id, deleted=False):
+        # Same as a committed execute_query, but mirrored into the registry instead of invalidating it
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            self.conn.execute(query, params)
+            self.conn.commit()
+            if deleted:
+                self.accounts.remove_by_api_id(api_id)
+            else:
+                self._refresh_accounts("api_id", [api_id])
+            return True
+    
     def update_account(self, api_id, user_id, username, name):
-        return self.execute_query(
-            "UPDATE accounts SET user_id=?, username=?, name=? WHERE api_id=?", 
-            (user_id, username, name, api_id), 
-            commit=True
-        )
+        return self._retry(self._write_accounts_once, HOT_QUERIES['update_account'],
+                           (user_id, username, name, api_id), api_id)
     
     def delete_account(self, api_id):
-        return self.execute_query("DELETE FROM accounts WHERE api_id=?", (api_id,), commit=True)
+        return self._retry(self._write_accounts_once, HOT_QUERIES['delete_account'], (api_id,), api_id, True)
 
     def count_accounts(self):
-        result = self.execute_query("SELECT COUNT(*) FROM accounts", fetch_all=True)
-        return result[0][0] if result else 0
\ No newline at end of file
+        return self._registry().count()
+
+    async def aget_all_accounts(self):
+        return (await self._aregistry()).all()
+    
+    async def aget_account_by_api_id(self, api_id):
+        accounts = (await self._aregistry()).find_by_api_id(api_id)
+        return accounts[0] if accounts else None
+    
+    async def aget_account_by_phone(self, phone):
+        return (await self._aregistry()).get(phone)
+    
+    async def aget_account_by_user_id(self, user_id):
+        accounts = (await self._aregistry()).find_by_user_id(user_id)
+        return accounts[0] if accounts else None
+    
+    async def aget_account_by_username(self, username):
+        accounts = (await self._aregistry()).find_by_username(username)
+        return accounts[0] if accounts else None
+    
+    async def aupdate_account(self, api_id, user_id, username, name):
+        return await self._aretry(self._write_accounts_once, HOT_QUERIES['update_account'],
+                                  (user_id, username, name, api_id), api_id)
+    
+    async def aupdate_twofa(self, api_id, twofa):
+        return await self._aretry(self._write_accounts_once, HOT_QUERIES['update_twofa'], (twofa, api_id), api_id)
+    
+    async def adelete_account(self, api_id):
+        return await self._aretry(self._write_accounts_once, HOT_QUERIES['delete_account'], (api_id,), api_id, True)
+    
+    async def acount_accounts(self):
+        return (await self._aregistry()).count()
+    
+    async def apragma(self, name):
+        # Value of a PRAGMA, read on a reader connection
+        result = await self.aexecute_query(f"PRAGMA {name}", fetch_all=True)
+        return result[0][0] if result else None
+    
+    def _check_writable_once(self):
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("COMMIT")
+            return True
+    
+    async def acheck_writable(self):
+        # Take and release the write lock once; raises if the database is locked
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._check_writable_once)
+    
+    def _query_plans_once(self):
+        with self._lock:
+            if not self.conn:
+                self._setup_database()
+            plans = []
+            for name, query in HOT_QUERIES.items():
+                query = query.format(placeholders=', '.join('?' * UPSERT_LOOKUP_CHUNK))
+                rows = self.conn.execute(f"EXPLAIN QUERY PLAN {query}", (None,) * query.count('?')).fetchall()
+                details = [row[-1] for row in rows]
+                # Any SCAN reads every row, of the table or of an index ("SCAN accounts USING COVERING INDEX")
+                full_scan = any(detail.startswith("SCAN") for detail in details)
+                plans.append({'query': name, 'plan': "; ".join(details), 'full_scan': full_scan})
+            return plans
+    
+    def check_query_plans(self):
+        # EXPLAIN QUERY PLAN of every hot statement; full_scan marks the ones reading every row
+        return self._retry(self._query_plans_once)
+    
+    async def acheck_query_plans(self):
+        return await self._aretry(self._query_plans_once)
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._reader_executor:
+            self._reader_executor.shutdown(wait=True)
+        with self._lock:
+            self._close_connection()
\ No newline at end of file
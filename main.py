@@ -6,6 +6,11 @@ import signal
 from core import UnlimitedLoginSystem
 from db.database_manager import DatabaseManager
 from telegram.client_manager import ClientManager
+from telegram.client_supervisor import ClientSupervisor
+from telegram.entity_cache import EntityCache
+from telegram.health_monitor import HealthMonitor
+from telegram.session_store import open_session_store
+from telegram.worker_pool import WorkerPool
 from rules.rules_manager import RulesManager
 from telegram.message_handler import MessageHandler
 from ui import MainMenu, AccountManagement, AutoResponderMenu, TaskSchedulingMenu, WorkCycleMenu, AnalyticsMenu, StatusMenu
@@ -16,18 +21,29 @@ async def main():
 
     # Inisialisasi sistem
     db_manager = DatabaseManager()
-    client_manager = ClientManager()
+    session_store = open_session_store()
+    client_manager = ClientManager(session_store=session_store)
     rules_manager = RulesManager()
-    message_handler = MessageHandler(rules_manager)
+    entity_cache = EntityCache()
+    entity_cache.load()
+    entity_cache.start()
+    message_handler = MessageHandler(rules_manager, entity_cache=entity_cache, connector=client_manager.connected)
+    client_manager.add_disconnect_listener(message_handler.remove_handler)
+    supervisor = ClientSupervisor(client_manager, message_handler)
+    supervisor.start()
+    health_monitor = HealthMonitor(client_manager)
+    health_monitor.start()
+    # Started on first use; the status menu reads the accounts running in its workers
+    worker_pool = WorkerPool(rules_manager, client_manager=client_manager)
     system = UnlimitedLoginSystem() # Meskipun minimal, instance tetap dibuat
 
     # Membuat instance dari setiap menu UI
     account_manager = AccountManagement(db_manager, client_manager)
-    auto_responder_menu = AutoResponderMenu(rules_manager, client_manager, message_handler, db_manager)
+    auto_responder_menu = AutoResponderMenu(rules_manager, client_manager, message_handler, db_manager, worker_pool)
     task_scheduling_menu = TaskSchedulingMenu()
     work_cycle_menu = WorkCycleMenu()
     analytics_menu = AnalyticsMenu(db_manager, client_manager)
-    status_menu = StatusMenu(db_manager, client_manager)
+    status_menu = StatusMenu(db_manager, client_manager, supervisor, health_monitor, worker_pool)
 
     # Membuat instance dari MainMenu dan memberikan dependensi
     ui = MainMenu(account_manager, auto_responder_menu, task_scheduling_menu,
@@ -36,8 +52,16 @@ async def main():
     loop = asyncio.get_event_loop()
 
     async def shutdown():
+        # Stop reconnecting before the clients are disconnected on purpose
+        await supervisor.stop()
+        await health_monitor.stop()
+        await message_handler.scheduler.stop()
+        await auto_responder_menu.shutdown_workers()
         await client_manager.disconnect_all_clients()
-        db_manager._close_connection()
+        if session_store is not None:
+            session_store.close()
+        entity_cache.close()
+        db_manager.close()
         logging.info("Program shutdown complete")
 
     def shutdown_handler(signame):
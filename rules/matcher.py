@@ -0,0 +1,265 @@
+# rules/matcher.py
+import logging
+import re
+from collections import deque
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+MATCH_TYPES = ('contains', 'word', 'prefix', 'exact', 'regex')
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+def _required_literal(pattern):
+    # Longest run of ASCII characters every match of pattern contains, or '' if there is none
+    try:
+        items = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return ''
+    best = run = ''
+    for op, av in items:
+        if op is sre_constants.LITERAL and av < 128:
+            run += chr(av)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ''
+    return best
+
+class KeywordMatcher:
+    # Aho-Corasick automaton over casefolded keywords; the value of the lowest-ordered hit wins
+    def __init__(self, keywords, whole_word=False):
+        self.values = []
+        self.whole_word = whole_word
+        self.always = ()
+        self._lengths = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for order, (value, keyword) in enumerate(keywords):
+            self.values.append(value)
+            keyword = keyword.casefold()
+            self._lengths.append(len(keyword))
+            if not keyword:
+                # '' in text is always True, keep that behaviour for odd imports
+                if not whole_word:
+                    self.always = self.always + (order,)
+                continue
+            self._insert(keyword, order)
+        self._build_failure_links()
+
+    def _insert(self, keyword, order):
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] = self._out[state] + (order,)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # Fold the outputs of the failure chain in so matching never walks it
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        # Precompute the lowest rule order reachable from each state
+        self._best = [min(out) if out else None for out in self._out]
+
+    def __len__(self):
+        return len(self.values)
+
+    def _is_whole_word(self, folded, end, order):
+        start = end - self._lengths[order] + 1
+        if start > 0 and _is_word_char(folded[start - 1]) and _is_word_char(folded[start]):
+            return False
+        if end + 1 < len(folded) and _is_word_char(folded[end + 1]) and _is_word_char(folded[end]):
+            return False
+        return True
+
+    def iter_matches(self, text):
+        # Yield the order index of every keyword found in text (may repeat)
+        yield from self.always
+        goto, fail, out = self._goto, self._fail, self._out
+        folded = text.casefold()
+        state = 0
+        for pos, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for order in out[state]:
+                if not self.whole_word or self._is_whole_word(folded, pos, order):
+                    yield order
+
+    def first_match(self, text, folded=False):
+        # Return the value of the lowest-ordered keyword found in text, or None
+        if not self.values:
+            return None
+        if not folded:
+            text = text.casefold()
+        if self.whole_word:
+            best = min(self.iter_matches(text), default=None)
+            return self.values[best] if best is not None else None
+        best = self.always[0] if self.always else None
+        if best == 0:
+            return self.values[0]
+        goto, fail, best_at = self._goto, self._fail, self._best
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found = best_at[state]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+        return self.values[best] if best is not None else None
+
+class PrefixMatcher:
+    # Trie over keywords that must appear at the start of the message
+    def __init__(self, keywords):
+        self.values = []
+        self._root = {}
+        self._empty = None
+        for order, (value, keyword) in enumerate(keywords):
+            self.values.append(value)
+            keyword = keyword.casefold()
+            if not keyword:
+                if self._empty is None:
+                    self._empty = order
+                continue
+            node = self._root
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node.setdefault(None, order)
+
+    def __len__(self):
+        return len(self.values)
+
+    def first_match(self, text, folded=False):
+        if not self.values:
+            return None
+        if not folded:
+            text = text.casefold()
+        best = self._empty
+        node = self._root
+        for char in text.lstrip():
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(None)
+            if found is not None and (best is None or found < best):
+                best = found
+        return self.values[best] if best is not None else None
+
+class ExactMatcher:
+    # Hash lookup for keywords that must equal the whole message
+    def __init__(self, keywords):
+        self.values = []
+        self._index = {}
+        for order, (value, keyword) in enumerate(keywords):
+            self.values.append(value)
+            self._index.setdefault(keyword.casefold().strip(), order)
+
+    def __len__(self):
+        return len(self.values)
+
+    def first_match(self, text, folded=False):
+        if not self.values:
+            return None
+        if not folded:
+            text = text.casefold()
+        order = self._index.get(text.strip())
+        return self.values[order] if order is not None else None
+
+class RegexMatcher:
+    # Each regex is searched on its own, but only when the literal text it requires occurs
+    # in the message; those literals are found for every rule in one Aho-Corasick pass
+    def __init__(self, keywords, flags=re.IGNORECASE):
+        self.values = []
+        self._patterns = []
+        self._unfiltered = []
+        literals = []
+        for order, (value, keyword) in enumerate(keywords):
+            self.values.append(value)
+            try:
+                pattern = re.compile(keyword, flags)
+            except re.error as e:
+                logging.warning(f"Skipping invalid regex rule {keyword!r}: {str(e)}")
+                continue
+            index = len(self._patterns)
+            self._patterns.append((order, pattern))
+            literal = _required_literal(pattern)
+            if literal:
+                literals.append((index, literal))
+            else:
+                self._unfiltered.append(index)
+        self._prefilter = KeywordMatcher(literals)
+
+    def __len__(self):
+        return len(self.values)
+
+    def first_match(self, text, folded=False):
+        if not self._patterns:
+            return None
+        # IGNORECASE lets 'i' match the dotless i, which casefold() leaves alone
+        found = self._prefilter.iter_matches(text.replace('\u0131', 'i'))
+        candidates = set(self._unfiltered)
+        candidates.update(self._prefilter.values[hit] for hit in found)
+        for index in sorted(candidates):
+            order, pattern = self._patterns[index]
+            if pattern.search(text):
+                return self.values[order]
+        return None
+
+class RuleMatcher:
+    # One combined matcher per match type in use; the lowest-ordered hit of any type wins
+    def __init__(self, entries):
+        self.values = []
+        by_type = {match_type: [] for match_type in MATCH_TYPES}
+        for order, (value, match_type, keyword) in enumerate(entries):
+            self.values.append(value)
+            by_type.get(match_type, by_type['contains']).append((order, keyword))
+        # Cheapest lookups first; the regex scan runs last
+        self._matchers = [
+            (matcher, match_type == 'regex')
+            for match_type, matcher in (
+                ('exact', ExactMatcher(by_type['exact'])),
+                ('prefix', PrefixMatcher(by_type['prefix'])),
+                ('contains', KeywordMatcher(by_type['contains'])),
+                ('word', KeywordMatcher(by_type['word'], whole_word=True)),
+                ('regex', RegexMatcher(by_type['regex'])),
+            )
+            if len(matcher)
+        ]
+
+    def __len__(self):
+        return len(self.values)
+
+    def first_match(self, text):
+        folded = text.casefold()
+        best = None
+        for matcher, raw in self._matchers:
+            order = matcher.first_match(text) if raw else matcher.first_match(folded, folded=True)
+            if order is not None and (best is None or order < best):
+                best = order
+                if best == 0:
+                    break
+        return self.values[best] if best is not None else None
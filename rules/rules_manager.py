@@ -3,11 +3,17 @@ import os
 import logging
 import json
 import random
+import re
+
+from .matcher import MATCH_TYPES
+from .snapshot import RuleSnapshot
 
 class RulesManager:
     def __init__(self, rules_file='responder_rules.json'):
         self.rules_file = rules_file
         self.rules = {}
+        self.snapshot = RuleSnapshot({})
+        self.snapshot_listeners = []
         self._load_rules()
     def _load_rules(self):
         if os.path.exists(self.rules_file):
@@ -21,6 +27,17 @@ class RulesManager:
         else:
             self.rules = {}
             self._save_rules()
+        self._publish_snapshot()
+    def _publish_snapshot(self):
+        # Build the whole snapshot first, then swap it in with one assignment
+        self.snapshot = RuleSnapshot(self.rules, self.snapshot.version + 1)
+        for callback in self.snapshot_listeners:
+            try:
+                callback(self.snapshot)
+            except Exception as e:
+                logging.error(f"Error in rules snapshot listener: {str(e)}")
+    def add_snapshot_listener(self, callback):
+        self.snapshot_listeners.append(callback)
     def _migrate_rules_format(self):
         changed = False
         for rule_id, rule in self.rules.items():
@@ -32,6 +49,7 @@ class RulesManager:
             self._save_rules()
             logging.info("Rules migrated to support multiple responses")
     def _save_rules(self):
+        self._publish_snapshot()
         try:
             with open(self.rules_file, 'w', encoding='utf-8') as f:
                 json.dump(self.rules, f, indent=4)
@@ -44,19 +62,41 @@ class RulesManager:
         return self.rules
     def get_rule(self, rule_id):
         return self.rules.get(rule_id)
-    def add_rule(self, keyword, response, private_only=False):
+    def get_snapshot(self):
+        return self.snapshot
+    def _validate_match_type(self, keyword, match_type):
+        if match_type not in MATCH_TYPES:
+            return f"Tipe pencocokan {match_type} tidak dikenal!"
+        if match_type == 'regex':
+            try:
+                re.compile(keyword)
+            except re.error as e:
+                return f"Pola regex tidak valid: {str(e)}"
+        return None
+    def add_rule(self, keyword, response, private_only=False, match_type='contains'):
         if not keyword.strip() or not response.strip():
             return False, "Kata kunci dan pesan balasan tidak boleh kosong!"
+        error = self._validate_match_type(keyword, match_type)
+        if error:
+            return False, error
         rule_id = str(len(self.rules) + 1)
-        self.rules[rule_id] = {'keyword': keyword, 'responses': [response], 'private_only': private_only}
+        self.rules[rule_id] = {'keyword': keyword, 'responses': [response], 'private_only': private_only,
+                               'match_type': match_type}
         saved = self._save_rules()
         return saved, f"Aturan dengan ID {rule_id} berhasil ditambahkan!" if saved else "Gagal menyimpan aturan!"
-    def update_rule(self, rule_id, keyword=None, response=None, private_only=None):
+    def update_rule(self, rule_id, keyword=None, response=None, private_only=None, match_type=None):
         if rule_id not in self.rules:
             return False, f"Aturan dengan ID {rule_id} tidak ditemukan!"
         rule = self.rules[rule_id]
+        if keyword is not None or match_type is not None:
+            new_keyword = keyword if keyword is not None and keyword.strip() else rule['keyword']
+            error = self._validate_match_type(new_keyword, match_type or rule.get('match_type', 'contains'))
+            if error:
+                return False, error
         if keyword is not None and keyword.strip():
             rule['keyword'] = keyword
+        if match_type is not None:
+            rule['match_type'] = match_type
         if response is not None and response.strip():
             if 'responses' not in rule:
                 rule['responses'] = []
@@ -85,15 +125,10 @@ class RulesManager:
         saved = self._save_rules()
         return saved, f"Respons pada indeks {response_index} berhasil dihapus!" if saved else "Gagal menghapus respons!"
     def get_random_response(self, rule_id):
-        rule = self.rules.get(rule_id)
-        if not rule:
-            return None
-        responses = rule.get('responses', [])
-        if not responses and 'response' in rule:
-            return rule['response']
-        if not responses:
+        rule = self.snapshot.by_id.get(rule_id)
+        if not rule or not rule.responses:
             return None
-        return random.choice(responses)
+        return random.choice(rule.responses)
     def export_rules(self, filename="responder_rules_export.json"):
         if not self.rules:
             return False, "Tidak ada aturan yang dapat diekspor."
@@ -119,8 +154,9 @@ class RulesManager:
             if replace:
                 self.rules = imported_rules
             else:
+                merged_rules = dict(self.rules)
                 highest_id = 0
-                for rule_id in self.rules:
+                for rule_id in merged_rules:
                     try:
                         rule_id_int = int(rule_id)
                         if rule_id_int > highest_id:
@@ -128,11 +164,12 @@ class RulesManager:
                     except ValueError:
                         pass
                 for rule_id, rule in imported_rules.items():
-                    if rule_id not in self.rules:
-                        self.rules[rule_id] = rule
+                    if rule_id not in merged_rules:
+                        merged_rules[rule_id] = rule
                     else:
                         highest_id += 1
-                        self.rules[str(highest_id)] = rule
+                        merged_rules[str(highest_id)] = rule
+                self.rules = merged_rules
             saved = self._save_rules()
             return saved, f"Berhasil mengimpor aturan. Total aturan saat ini: {len(self.rules)}"
         except Exception as e:
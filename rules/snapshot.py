@@ -0,0 +1,56 @@
+# rules/snapshot.py
+from collections import namedtuple
+from types import MappingProxyType
+
+from .matcher import MATCH_TYPES, RuleMatcher
+
+CompiledRule = namedtuple('CompiledRule', ['rule_id', 'keyword', 'responses', 'private_only', 'match_type'])
+
+def compile_rule(rule_id, rule):
+    # Normalize one stored rule dict into a CompiledRule, or None if it has no keyword
+    keyword = rule.get('keyword')
+    if keyword is None:
+        return None
+    match_type = rule.get('match_type', 'contains')
+    if match_type not in MATCH_TYPES:
+        match_type = 'contains'
+    responses = rule.get('responses', [])
+    if not responses and 'response' in rule:
+        responses = [rule['response']]
+    return CompiledRule(
+        rule_id=rule_id,
+        keyword=keyword if match_type == 'regex' else keyword.casefold(),
+        responses=tuple(r for r in responses if r),
+        private_only=bool(rule.get('private_only', False)),
+        match_type=match_type
+    )
+
+class RuleSnapshot:
+    # Compiled rule set, swapped in whole so readers never see a half-edited one
+    __slots__ = ('version', 'rules', 'by_id', 'private_rules', 'group_rules',
+                 'private_matcher', 'group_matcher')
+
+    def __init__(self, rules, version=0):
+        compiled = tuple(c for c in (compile_rule(rule_id, rule) for rule_id, rule in rules.items())
+                         if c is not None)
+        private_rules = compiled
+        group_rules = tuple(c for c in compiled if not c.private_only)
+        set_attr = object.__setattr__
+        set_attr(self, 'version', version)
+        set_attr(self, 'rules', compiled)
+        set_attr(self, 'by_id', MappingProxyType({c.rule_id: c for c in compiled}))
+        set_attr(self, 'private_rules', private_rules)
+        set_attr(self, 'group_rules', group_rules)
+        set_attr(self, 'private_matcher', RuleMatcher([(c, c.match_type, c.keyword) for c in private_rules]))
+        set_attr(self, 'group_matcher', RuleMatcher([(c, c.match_type, c.keyword) for c in group_rules]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RuleSnapshot is read-only")
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, message_text, is_private):
+        # Return the first CompiledRule matching message_text for this chat type, or None
+        matcher = self.private_matcher if is_private else self.group_matcher
+        return matcher.first_match(message_text)
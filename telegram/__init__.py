@@ -1,3 +1,4 @@
 # telegram/__init__.py
 from .client_manager import ClientManager
+from .client_supervisor import ClientSupervisor
 from .message_handler import MessageHandler
\ No newline at end of file
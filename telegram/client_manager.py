@@ -1,25 +1,256 @@
 # telegram/client_manager.py
 import os
+import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
 
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError, RPCError
 
+from .session_store import StoredSession
+
+# Seconds a single probe may take before it is reported as timed out
+PROBE_TIMEOUT = 30
+PROBE_CONCURRENCY = 20
+# Seconds allowed for connecting and checking one account during responder activation
+ACTIVATION_TIMEOUT = 60
+# Seconds an unused pooled client stays connected
+POOL_IDLE_TIMEOUT = 300
+# Fleet-wide cap on open connections; None keeps every connection it is asked for
+MAX_OPEN_CONNECTIONS = None
+# Probe clients only answer authorization checks and get_me, so they skip
+# the update stream, the catch-up on connect and most of the entity cache
+PROBE_CLIENT_OPTIONS = {'receive_updates': False, 'catch_up': False, 'entity_cache_limit': 100}
+# On-demand responder clients fetch the updates they missed while disconnected
+ON_DEMAND_CLIENT_OPTIONS = {'catch_up': True}
+# Seconds a disconnected on-demand account waits before it is reconnected to check for messages
+ON_DEMAND_VISIT_INTERVAL = 60
+# Seconds an on-demand account stays held on such a visit, enough to catch up and queue replies
+ON_DEMAND_VISIT_SECONDS = 20
+ON_DEMAND_VISIT_CONCURRENCY = 10
+
 class ClientManager:
-    def __init__(self):
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT, session_store=None, max_open_connections=MAX_OPEN_CONNECTIONS):
         self.active_clients = {}
+        self.session_store = session_store
+        self.disconnect_listeners = []
+        self.idle_timeout = idle_timeout
+        self.max_open_connections = max_open_connections
+        self.pool = {}
+        self._pool_locks = {}
+        self._reaper_task = None
+        self._opening = 0
+        self._capacity_freed = asyncio.Event()
+        self.evictions = 0
+        self.capacity_waits = 0
+        # Phones whose session is in use by a worker process; never opened here meanwhile
+        self.handed_off = set()
+        # Responder accounts that only hold a connection while work targets them
+        self.on_demand = {}
+        self._visit_task = None
         os.makedirs('session', exist_ok=True)
-    async def create_client(self, api_id, api_hash, phone, default_2fa=None):
+    def _new_client(self, api_id, api_hash, phone, probe=False):
+        on_demand = None if probe else self.on_demand.get(phone)
+        if on_demand is not None and on_demand['client'] is not None:
+            # Reconnecting the same client keeps the responder handler attached to it
+            return on_demand['client']
+        options = PROBE_CLIENT_OPTIONS if probe else ON_DEMAND_CLIENT_OPTIONS if on_demand is not None else {}
+        session = f'session/{phone}'
+        if self.session_store is not None:
+            # Accounts that were not migrated yet are imported on first use
+            if not self.session_store.has_session(phone) and os.path.exists(f'{session}.session'):
+                self.session_store.import_session_file(f'{session}.session', phone)
+            session = StoredSession(self.session_store, phone)
+        client = TelegramClient(session, api_id, api_hash, **options)
+        if on_demand is not None:
+            on_demand['client'] = client
+        return client
+    async def create_client(self, api_id, api_hash, phone, default_2fa=None, probe=False):
         client = None
         try:
-            client = TelegramClient(f'session/{phone}', api_id, api_hash)
+            client = self._new_client(api_id, api_hash, phone, probe)
             await client.connect()
             return client
-        except Exception as e:
-            logging.error(f"Error creating client for {phone}: {str(e)}")
-            if client and client.is_connected():
-                await client.disconnect()
+        except BaseException as e:
+            # Timeouts cancel connect() midway, so a half-connected client is closed here too
+            if isinstance(e, Exception):
+                logging.error(f"Error creating client for {phone}: {str(e)}")
+            if client:
+                await self._safe_disconnect(client, phone, force=True)
+            raise
+    async def acquire_client(self, api_id, api_hash, phone, probe=False, fail_if_full=False):
+        # A full request replaces an unused pooled probe client, since both would share the session file
+        if phone in self.handed_off:
+            raise RuntimeError(f"Sesi {phone} sedang dipakai oleh worker")
+        lock = self._pool_locks.setdefault(phone, asyncio.Lock())
+        async with lock:
+            entry = self.pool.get(phone)
+            if entry and entry['probe'] and not probe:
+                while entry['refs']:
+                    await asyncio.sleep(0.1)
+                await self._close_entry(phone, entry)
+                entry = None
+            if entry is not None:
+                # Pinned before any await so eviction never picks it
+                entry['refs'] += 1
+                if not entry['client'].is_connected():
+                    try:
+                        await entry['client'].connect()
+                    except BaseException as e:
+                        entry['refs'] -= 1
+                        if not entry['refs']:
+                            await self._close_entry(phone, entry, force=True)
+                        if entry['refs'] or not isinstance(e, Exception):
+                            raise
+                        logging.warning(f"Pooled client for {phone} failed to reconnect: {str(e)}")
+                        entry = None
+            if entry is None:
+                await self._reserve_slot(fail_if_full)
+                try:
+                    client = await self.create_client(int(api_id), api_hash, phone, probe=probe)
+                finally:
+                    self._opening -= 1
+                entry = self.pool[phone] = {'client': client, 'refs': 1, 'probe': probe,
+                                            'last_used': time.monotonic()}
+            entry['last_used'] = time.monotonic()
+        self._start_reaper()
+        return entry['client']
+    async def release_client(self, phone, discard=False):
+        # Return a borrowed client; discard closes it once nobody else holds it
+        entry = self.pool.get(phone)
+        if entry is None:
+            return
+        entry['refs'] = max(entry['refs'] - 1, 0)
+        entry['last_used'] = time.monotonic()
+        if discard:
+            entry['discard'] = True
+        if entry['refs'] == 0:
+            self._capacity_freed.set()
+            if entry.get('discard'):
+                await self._close_entry(phone, entry)
+    async def _reserve_slot(self, fail_if_full=False):
+        # Wait for room under the connection cap, evicting idle clients in LRU order
+        while self.max_open_connections and len(self.pool) + self._opening >= self.max_open_connections:
+            # Permanent active clients hold their connection until stopped, so waiting on them is pointless
+            pinned = sum(1 for phone in self.pool if phone in self.active_clients and phone not in self.on_demand)
+            if fail_if_full and pinned >= self.max_open_connections:
+                raise RuntimeError(f"batas koneksi tercapai ({self.max_open_connections} koneksi aktif)")
+            idle = [(entry['last_used'], phone) for phone, entry in self.pool.items() if entry['refs'] == 0]
+            if idle:
+                _, phone = min(idle)
+                self.evictions += 1
+                logging.debug(f"Evicting idle client {phone} to stay under the connection cap")
+                await self._close_entry(phone, self.pool[phone])
+                continue
+            self.capacity_waits += 1
+            self._capacity_freed.clear()
+            await self._capacity_freed.wait()
+        self._opening += 1
+    def connection_stats(self):
+        busy = sum(1 for entry in self.pool.values() if entry['refs'])
+        return {
+            'open': len(self.pool),
+            'busy': busy,
+            'idle': len(self.pool) - busy,
+            'opening': self._opening,
+            'cap': self.max_open_connections,
+            'on_demand': len(self.on_demand),
+            'evictions': self.evictions,
+            'capacity_waits': self.capacity_waits
+        }
+    @asynccontextmanager
+    async def lease(self, api_id, api_hash, phone, probe=False):
+        client = await self.acquire_client(api_id, api_hash, phone, probe)
+        failed = False
+        try:
+            yield client
+        except BaseException:
+            failed = True
             raise
+        finally:
+            # A client that failed mid-operation is not trusted for reuse
+            await self.release_client(phone, discard=failed)
+    async def _close_entry(self, phone, entry, force=False):
+        if self.pool.get(phone) is entry:
+            del self.pool[phone]
+            self._capacity_freed.set()
+            if phone in self.on_demand:
+                # Caught up until now; the next visit is due one interval later
+                self.on_demand[phone]['disconnected'] = time.monotonic()
+        await self._safe_disconnect(entry['client'], phone, force)
+    def _start_reaper(self):
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reap_idle_clients())
+    async def _reap_idle_clients(self):
+        while self.pool:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            now = time.monotonic()
+            for phone, entry in list(self.pool.items()):
+                if entry['refs'] == 0 and now - entry['last_used'] >= self.idle_timeout:
+                    logging.debug(f"Closing idle pooled client {phone}")
+                    await self._close_entry(phone, entry)
+    async def hand_off(self, phone):
+        # Close the pooled client of phone so another process can own its session
+        async with self._pool_locks.setdefault(phone, asyncio.Lock()):
+            entry = self.pool.get(phone)
+            if phone in self.active_clients or (entry and entry['refs']):
+                raise RuntimeError(f"Sesi {phone} sedang dipakai di proses utama")
+            if entry:
+                await self._close_entry(phone, entry)
+            self.handed_off.add(phone)
+    def take_back(self, phone):
+        self.handed_off.discard(phone)
+    @asynccontextmanager
+    async def connected(self, phone):
+        # Keeps an on-demand account connected while the responder talks through it
+        account = self.on_demand.get(phone)
+        if account is None:
+            yield
+            return
+        await self.acquire_client(account['api_id'], account['api_hash'], phone)
+        try:
+            yield
+        finally:
+            await self.release_client(phone)
+    def _start_visits(self):
+        if self._visit_task is None or self._visit_task.done():
+            self._visit_task = asyncio.create_task(self._visit_on_demand())
+    async def _visit_on_demand(self):
+        # A disconnected account receives nothing, so each one is reconnected in
+        # turn and Telethon catches up on the messages it missed meanwhile
+        semaphore = asyncio.Semaphore(ON_DEMAND_VISIT_CONCURRENCY)
+        while self.on_demand:
+            now = time.monotonic()
+            due = sorted((account['disconnected'], phone) for phone, account in self.on_demand.items()
+                         if phone not in self.pool and now - account['disconnected'] >= ON_DEMAND_VISIT_INTERVAL)
+            await asyncio.gather(*(self._visit(phone, semaphore) for _, phone in due))
+            await asyncio.sleep(max(ON_DEMAND_VISIT_INTERVAL / 4, 1))
+    async def _visit(self, phone, semaphore):
+        async with semaphore:
+            account = self.on_demand.get(phone)
+            if account is None or phone in self.pool:
+                return
+            try:
+                await asyncio.wait_for(self.acquire_client(account['api_id'], account['api_hash'], phone),
+                                       timeout=ACTIVATION_TIMEOUT)
+            except Exception as e:
+                logging.warning(f"On-demand visit to {phone} failed: {str(e)}")
+                account['disconnected'] = time.monotonic()
+                return
+            try:
+                await asyncio.sleep(ON_DEMAND_VISIT_SECONDS)
+            finally:
+                await self.release_client(phone)
+    async def close_pool(self):
+        if self._reaper_task and not self._reaper_task.done():
+            self._reaper_task.cancel()
+        if self._visit_task and not self._visit_task.done():
+            self._visit_task.cancel()
+        for phone, entry in list(self.pool.items()):
+            await self._close_entry(phone, entry)
+        if self.session_store is not None:
+            self.session_store.request_flush()
     async def authorize_client(self, client, phone, default_2fa=None, code_callback=None):
         try:
             if not await client.is_user_authorized():
@@ -48,25 +279,133 @@ class ClientManager:
             return {'phone': phone, 'status': 'Gagal', 'error': str(e)}
         except Exception as e:
             return {'phone': phone, 'status': 'Error', 'error': str(e)}
+    async def _safe_disconnect(self, client, phone, force=False):
+        try:
+            if force or client.is_connected():
+                await asyncio.wait_for(client.disconnect(), timeout=10)
+        except Exception as e:
+            logging.error(f"Error disconnecting client {phone}: {str(e)}")
+    async def _probe(self, api_id, api_hash, phone):
+        # The lease is returned on failure, timeout and cancellation alike,
+        # and a client that failed is closed instead of going back to the pool
+        client = await self.acquire_client(api_id, api_hash, phone, probe=True)
+        result = None
+        try:
+            result = await self.test_connection(client, phone)
+            return result
+        finally:
+            await self.release_client(phone, discard=result is None or result['status'] != 'Berhasil')
+    async def probe_account(self, api_id, api_hash, phone, timeout=PROBE_TIMEOUT):
+        # Check authorization through a pooled probe client, within timeout seconds
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._probe(api_id, api_hash, phone), timeout=timeout)
+        except asyncio.TimeoutError:
+            result = {'phone': phone, 'status': 'Timeout', 'error': f"Tidak selesai dalam {timeout} detik"}
+        except Exception as e:
+            result = {'phone': phone, 'status': 'Error', 'error': str(e)}
+        result['api_id'] = api_id
+        result['elapsed'] = round(time.monotonic() - started, 2)
+        return result
+    async def probe_accounts(self, accounts, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+        # Probe account rows in parallel and yield (account, result) as each probe finishes
+        semaphore = asyncio.Semaphore(concurrency)
+        async def probe(account):
+            async with semaphore:
+                return account, await self.probe_account(account[0], account[1], account[2], timeout)
+        for account in accounts:
+            if account[2] in self.handed_off:
+                yield account, {'phone': account[2], 'status': 'Dilewati', 'error': "Sesi dipakai oleh worker",
+                                'api_id': account[0], 'elapsed': 0}
+        tasks = [asyncio.create_task(probe(account)) for account in accounts if account[2] not in self.handed_off]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    async def activate_account(self, account, message_handler, account_delay, semaphore, start_at,
+                               timeout=ACTIVATION_TIMEOUT, on_demand=False):
+        # Connect one account and attach the responder; returns (phone, failure reason or None)
+        api_id, api_hash, phone = account[0], account[1], account[2]
+        wait = start_at - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        async with semaphore:
+            acquired = False
+            if on_demand:
+                self.on_demand[phone] = {'api_id': api_id, 'api_hash': api_hash, 'client': None, 'disconnected': 0}
+            try:
+                # On-demand accounts make room by evicting idle ones, so only permanent ones can find the cap full
+                client = await asyncio.wait_for(
+                    self.acquire_client(api_id, api_hash, phone, fail_if_full=not on_demand), timeout=timeout)
+                acquired = True
+                if not await asyncio.wait_for(client.is_user_authorized(), timeout=timeout):
+                    self.on_demand.pop(phone, None)
+                    await self.release_client(phone)
+                    return phone, "belum diotorisasi, silakan login terlebih dahulu"
+                message_handler.setup_handler(client, phone, account_delay)
+                self.add_active_client(phone, client)
+                if on_demand:
+                    # Idle from here on, so the cap may close it in LRU order; visits and replies reopen it
+                    self.on_demand[phone]['client'] = client
+                    await self.release_client(phone)
+                    self._start_visits()
+                # A permanent active client keeps its pool reference until disconnect_client
+                return phone, None
+            except asyncio.TimeoutError:
+                reason = f"timeout setelah {timeout} detik"
+            except Exception as e:
+                reason = str(e) or e.__class__.__name__
+            self.on_demand.pop(phone, None)
+            if acquired:
+                try:
+                    await self.release_client(phone, discard=True)
+                except Exception as e:
+                    logging.error(f"Error disconnecting client {phone}: {str(e)}")
+            return phone, reason
+    def add_disconnect_listener(self, callback):
+        self.disconnect_listeners.append(callback)
+    def _notify_disconnect(self, phone):
+        for callback in self.disconnect_listeners:
+            try:
+                callback(phone)
+            except Exception as e:
+                logging.error(f"Error in disconnect listener for {phone}: {str(e)}")
     def add_active_client(self, phone, client):
         self.active_clients[phone] = client
+        # Lets activations waiting on the cap re-check whether it is now full for good
+        self._capacity_freed.set()
     def remove_active_client(self, phone):
         if phone in self.active_clients:
             del self.active_clients[phone]
     async def disconnect_client(self, phone):
         if phone in self.active_clients:
             client = self.active_clients[phone]
-            if client and client.is_connected():
-                await client.disconnect()
+            self._notify_disconnect(phone)
             self.remove_active_client(phone)
+            on_demand = self.on_demand.pop(phone, None)
+            entry = self.pool.get(phone)
+            if entry and entry['client'] is client:
+                if on_demand is not None:
+                    # Holds no reference of its own; borrowers in flight fail on the closed client
+                    await self._close_entry(phone, entry)
+                else:
+                    await self.release_client(phone, discard=True)
+            elif client and client.is_connected():
+                await client.disconnect()
             return True
         return False
     async def disconnect_all_clients(self):
+        self.on_demand.clear()
         for phone, client in list(self.active_clients.items()):
             try:
+                self._notify_disconnect(phone)
                 if client and client.is_connected():
                     await client.disconnect()
             except Exception as e:
                 logging.error(f"Error disconnecting client {phone}: {str(e)}")
             finally:
-                self.remove_active_client(phone)
\ No newline at end of file
+                self.remove_active_client(phone)
+        await self.close_pool()
\ No newline at end of file
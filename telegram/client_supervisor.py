@@ -0,0 +1,102 @@
+# telegram/client_supervisor.py
+import asyncio
+import logging
+import random
+
+class ClientSupervisor:
+    # Reconnects dropped clients with jittered backoff, at most max_concurrent at a time
+    def __init__(self, client_manager, message_handler, check_interval=10, base_delay=2,
+                 max_delay=300, max_concurrent=5):
+        self.client_manager = client_manager
+        self.message_handler = message_handler
+        self.check_interval = check_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.reconnecting = {}
+        self.attempts = {}
+        self.reconnects = {}
+        self.failures = {}
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        tasks = list(self.reconnecting.values())
+        if self._task and not self._task.done():
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.reconnecting.clear()
+        self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for phone, client in list(self.client_manager.active_clients.items()):
+                # On-demand accounts are disconnected on purpose and reconnected by their visits
+                if phone in self.reconnecting or phone in self.client_manager.on_demand:
+                    continue
+                try:
+                    connected = client.is_connected()
+                except Exception as e:
+                    logging.error(f"Error checking client connection for {phone}: {str(e)}")
+                    connected = False
+                if not connected:
+                    logging.warning(f"Client {phone} is disconnected, scheduling reconnect")
+                    task = asyncio.create_task(self._reconnect(phone, client))
+                    self.reconnecting[phone] = task
+                    task.add_done_callback(lambda _, phone=phone: self.reconnecting.pop(phone, None))
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _still_active(self, phone, client):
+        return self.client_manager.active_clients.get(phone) is client
+
+    async def _reconnect(self, phone, client):
+        attempt = 0
+        while self._still_active(phone, client):
+            self.attempts[phone] = attempt + 1
+            await asyncio.sleep(self._backoff(attempt))
+            if not self._still_active(phone, client):
+                break
+            async with self.semaphore:
+                try:
+                    if not client.is_connected():
+                        await client.connect()
+                    authorized = await client.is_user_authorized()
+                except Exception as e:
+                    self.failures[phone] = self.failures.get(phone, 0) + 1
+                    logging.warning(f"Reconnect attempt {attempt + 1} for {phone} failed: {str(e)}")
+                    attempt += 1
+                    continue
+            if not self._still_active(phone, client):
+                # Stopped while we were connecting; do not leave an orphan connection
+                await client.disconnect()
+                break
+            if not authorized:
+                logging.error(f"Client {phone} is no longer authorized, stopping its responder")
+                await self.client_manager.disconnect_client(phone)
+                break
+            self.message_handler.reattach_handler(phone, client)
+            self.reconnects[phone] = self.reconnects.get(phone, 0) + 1
+            logging.info(f"Client {phone} reconnected after {attempt + 1} attempt(s)")
+            break
+        self.attempts.pop(phone, None)
+
+    def status(self, phone):
+        # Reconnect attempt in progress for phone, or None when it is not reconnecting
+        if phone in self.reconnecting:
+            return self.attempts.get(phone, 1)
+        return None
+
+    def stats(self):
+        return {
+            'reconnecting': {phone: self.attempts.get(phone, 1) for phone in self.reconnecting},
+            'reconnects': dict(self.reconnects),
+            'failures': dict(self.failures)
+        }
@@ -0,0 +1,123 @@
+# telegram/entity_cache.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from telethon import utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+from .responder_state import TTLCache
+
+ENTITY_CACHE_PATH = 'session/entity_cache.db'
+# Seconds between bulk writes of newly seen peers
+ENTITY_FLUSH_INTERVAL = 60
+
+_PEER_TYPES = {'user': InputPeerUser, 'chat': InputPeerChat, 'channel': InputPeerChannel}
+
+class EntityCache:
+    # (phone, peer id) -> input peer; stored on disk so replies after a restart skip the resolve round-trip
+    def __init__(self, path=ENTITY_CACHE_PATH, ttl=7 * 24 * 3600, max_entries=200000):
+        self.path = path
+        self.ttl = ttl
+        self.entries = TTLCache(max_entries, ttl)
+        self.dirty = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Every worker process writes this file, so writes wait for the lock on the flusher thread only
+        self.write_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.write_conn.execute("PRAGMA journal_mode=WAL")
+        with self.write_conn:
+            self.write_conn.execute('''
+                CREATE TABLE IF NOT EXISTS peers (
+                    phone TEXT,
+                    peer_id INTEGER,
+                    kind TEXT,
+                    entity_id INTEGER,
+                    access_hash INTEGER,
+                    seen_at REAL,
+                    PRIMARY KEY (phone, peer_id)
+                )
+            ''')
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    def load(self, phones=None):
+        # Warm the cache with every stored peer that has not expired yet
+        cutoff = time.time() - self.ttl
+        query, params = "SELECT * FROM peers WHERE seen_at > ?", [cutoff]
+        if phones:
+            query += f" AND phone IN ({', '.join('?' * len(phones))})"
+            params.extend(phones)
+        rows = self.conn.execute(query + " ORDER BY seen_at", params).fetchall()
+        for phone, peer_id, kind, entity_id, access_hash, seen_at in rows:
+            self.entries.set((phone, peer_id), (kind, entity_id, access_hash, seen_at))
+        logging.info(f"Entity cache warmed with {len(rows)} peers")
+        return len(rows)
+    def remember(self, phone, input_peer):
+        if isinstance(input_peer, InputPeerUser):
+            kind, entity_id, access_hash = 'user', input_peer.user_id, input_peer.access_hash
+        elif isinstance(input_peer, InputPeerChannel):
+            kind, entity_id, access_hash = 'channel', input_peer.channel_id, input_peer.access_hash
+        elif isinstance(input_peer, InputPeerChat):
+            kind, entity_id, access_hash = 'chat', input_peer.chat_id, 0
+        else:
+            return
+        key = (phone, utils.get_peer_id(input_peer))
+        known = self.entries.get(key)
+        now = time.time()
+        # Only a new peer, a changed hash or an old timestamp is worth a write
+        if known is None or known[2] != access_hash or now - known[3] > self.ttl / 2:
+            with self.lock:
+                self.dirty[key] = (*key, kind, entity_id, access_hash, now)
+            known = (kind, entity_id, access_hash, now)
+        self.entries.set(key, known)
+    def input_peer(self, phone, peer_id):
+        entry = self.entries.get((phone, peer_id))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        kind, entity_id, access_hash, _ = entry
+        if kind == 'chat':
+            return InputPeerChat(entity_id)
+        return _PEER_TYPES[kind](entity_id, access_hash)
+    def flush(self):
+        # Runs on the flusher thread except at shutdown
+        with self.lock:
+            rows = list(self.dirty.values())
+        if not rows:
+            return 0
+        try:
+            with self.write_conn:
+                self.write_conn.executemany("INSERT OR REPLACE INTO peers VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self.write_conn.execute("DELETE FROM peers WHERE seen_at <= ?", (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            logging.error(f"Error persisting entity cache: {str(e)}")
+            return 0
+        with self.lock:
+            for row in rows:
+                # A peer remembered again meanwhile keeps its newer row queued
+                if self.dirty.get(row[:2]) is row:
+                    del self.dirty[row[:2]]
+        return len(rows)
+    def start(self, interval=ENTITY_FLUSH_INTERVAL):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name='entity-cache-flush',
+                                             daemon=True)
+            self._flusher.start()
+    def _flush_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.flush()
+    def stats(self):
+        return {'peers': len(self.entries), 'pending_writes': len(self.dirty), 'hits': self.hits, 'misses': self.misses}
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        self.conn.close()
+        self.write_conn.close()
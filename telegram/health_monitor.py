@@ -0,0 +1,131 @@
+# telegram/health_monitor.py
+import asyncio
+import bisect
+import logging
+import random
+import time
+
+from telethon.tl.functions import PingRequest
+
+# Upper bounds (ms) of the RTT histogram buckets; the last bucket is open-ended
+RTT_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+class AccountHealth:
+    # RTT histogram, error count and last-seen time of one account
+    def __init__(self):
+        self.buckets = [0] * (len(RTT_BUCKETS) + 1)
+        self.pings = 0
+        self.errors = 0
+        self.rtt_total = 0
+        self.last_rtt = None
+        self.max_rtt = None
+        self.last_seen = None
+        self.last_error = None
+
+    def record(self, rtt_ms):
+        self.buckets[bisect.bisect_left(RTT_BUCKETS, rtt_ms)] += 1
+        self.pings += 1
+        self.rtt_total += rtt_ms
+        self.last_rtt = rtt_ms
+        self.max_rtt = rtt_ms if self.max_rtt is None else max(self.max_rtt, rtt_ms)
+        self.last_seen = time.time()
+
+    def record_error(self, error):
+        self.errors += 1
+        self.last_error = error
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of pings
+        if not self.pings:
+            return None
+        target = fraction * self.pings
+        seen = 0
+        for bound, count in zip(RTT_BUCKETS + (None,), self.buckets):
+            seen += count
+            if seen >= target:
+                return bound if bound is not None else self.max_rtt
+        return self.max_rtt
+
+    def summary(self):
+        return {
+            'pings': self.pings,
+            'errors': self.errors,
+            'last_rtt_ms': round(self.last_rtt, 1) if self.last_rtt is not None else None,
+            'avg_rtt_ms': round(self.rtt_total / self.pings, 1) if self.pings else None,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_rtt_ms': round(self.max_rtt, 1) if self.max_rtt is not None else None,
+            'histogram': dict(zip([f'<={bound}' for bound in RTT_BUCKETS] + [f'>{RTT_BUCKETS[-1]}'], self.buckets)),
+            'last_seen': self.last_seen,
+            'last_error': self.last_error
+        }
+
+class HealthMonitor:
+    # Pings every active client; a round is spread over the interval and capped by concurrency
+    def __init__(self, client_manager, interval=60, timeout=10, concurrency=10):
+        self.client_manager = client_manager
+        self.interval = interval
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.health = {}
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            clients = list(self.client_manager.active_clients.items())
+            await asyncio.gather(*(self._ping_later(phone, client, random.uniform(0, self.interval / 2))
+                                   for phone, client in clients))
+            # Forget accounts that are no longer active
+            for phone in set(self.health) - set(self.client_manager.active_clients):
+                del self.health[phone]
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 1))
+
+    async def _ping_later(self, phone, client, delay):
+        await asyncio.sleep(delay)
+        if self.client_manager.active_clients.get(phone) is not client:
+            return
+        # A parked on-demand account is not unhealthy, just not connected right now
+        if phone in self.client_manager.on_demand and not client.is_connected():
+            return
+        await self.ping(phone, client)
+
+    async def ping(self, phone, client):
+        health = self.health.setdefault(phone, AccountHealth())
+        if not client.is_connected():
+            health.record_error("Tidak terhubung")
+            return None
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(client(PingRequest(ping_id=random.getrandbits(63))), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                health.record_error(f"Timeout setelah {self.timeout} detik")
+                return None
+            except Exception as e:
+                logging.debug(f"Ping failed for {phone}: {str(e)}")
+                health.record_error(str(e) or e.__class__.__name__)
+                return None
+            rtt_ms = (time.perf_counter() - started) * 1000
+        health.record(rtt_ms)
+        return rtt_ms
+
+    def summary(self, phone):
+        health = self.health.get(phone)
+        return health.summary() if health else None
+
+    def all_summaries(self):
+        return {phone: health.summary() for phone, health in self.health.items()}
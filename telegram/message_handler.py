@@ -1,25 +1,134 @@
 # telegram/message_handler.py
-import asyncio
 import logging
 import time
 import random
+from collections import deque
+from contextlib import asynccontextmanager
 
 from telethon import events
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import SetTypingRequest
+from telethon.tl.types import SendMessageTypingAction
+
+from .rate_limiter import RateLimiter
+from .reply_scheduler import ReplyScheduler
+from .responder_state import ResponderState
+
+# Telegram clears a typing status after a few seconds unless it is resent
+TYPING_REFRESH_SECONDS = 4
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'coalesce')
+
+def _private_text(event):
+    return event.is_private and bool(event.raw_text)
+
+def _private_or_group_text(event):
+    # Broadcast channels never carry a conversation to answer
+    return (event.is_private or event.is_group) and bool(event.raw_text)
+
+def _drop_all(event):
+    return False
 
 class MessageHandler:
-    def __init__(self, rules_manager):
+    def __init__(self, rules_manager, max_concurrent_chats=5, max_account_queue=200,
+                 max_chat_queue=5, overflow_policy='drop_oldest', scheduler=None,
+                 chat_allowlist=None, chat_denylist=None, state=None, rate_limiter=None, entity_cache=None,
+                 connector=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
         self.rules_manager = rules_manager
-        self.message_queues = {}
+        self.max_concurrent_chats = max_concurrent_chats
+        self.max_account_queue = max_account_queue
+        self.max_chat_queue = max_chat_queue
+        self.overflow_policy = overflow_policy
+        self.scheduler = scheduler or ReplyScheduler()
+        self.chat_allowlist = set(chat_allowlist or ())
+        self.chat_denylist = set(chat_denylist or ())
+        self.event_filters = {}
+        self.clients = {}
+        self.chat_lanes = {}
+        self.active_chats = {}
+        self.waiting_chats = {}
+        self.chat_limits = {}
+        self.pending_counts = {}
+        self.shed_stats = {}
         self.handlers = {}
         self.delays = {}
-        self.last_responses = {}
-        self.last_response_times = {}
-    def setup_handler(self, client, phone, delay_seconds=0.5):
+        # Entries expire on their own, so stopped accounts and quiet chats
+        # do not pile up over weeks of uptime
+        self.state = state or ResponderState()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.entity_cache = entity_cache
+        # connector(phone) keeps an account connected while a reply goes out; None for always-on clients
+        self.connector = connector
+        self.rules_manager.add_snapshot_listener(self._on_rules_changed)
+    def _chat_scope(self, snapshot):
+        if not snapshot.private_rules:
+            return 'none'
+        if not snapshot.group_rules:
+            return 'private'
+        return 'private_and_groups'
+    def _build_event_filter(self):
+        # Build the NewMessage builder so Telethon drops updates no rule can answer
+        scope = self._chat_scope(self.rules_manager.get_snapshot())
+        func = {'none': _drop_all, 'private': _private_text, 'private_and_groups': _private_or_group_text}[scope]
+        if self.chat_allowlist:
+            chats, blacklist = list(self.chat_allowlist - self.chat_denylist), False
+            if not chats:
+                func = _drop_all
+        elif self.chat_denylist:
+            chats, blacklist = list(self.chat_denylist), True
+        else:
+            chats, blacklist = None, False
+        spec = (scope, tuple(sorted(chats)) if chats else None, blacklist)
+        return spec, events.NewMessage(incoming=True, chats=chats, blacklist_chats=blacklist, func=func)
+    def _attach_handler(self, phone):
+        client, handler = self.clients[phone], self.handlers[phone]
+        spec, event_filter = self._build_event_filter()
+        old = self.event_filters.get(phone)
+        if old is not None:
+            if old[0] == spec:
+                return
+            client.remove_event_handler(handler, events.NewMessage)
+        client.add_event_handler(handler, event_filter)
+        self.event_filters[phone] = (spec, event_filter)
+    def reattach_handler(self, phone, client):
+        # Attach the existing handler to a reconnected client, keeping queued replies
+        if phone not in self.handlers:
+            return False
+        old_client = self.clients.get(phone)
+        if old_client is not None and phone in self.event_filters:
+            try:
+                old_client.remove_event_handler(self.handlers[phone], events.NewMessage)
+            except Exception as e:
+                logging.warning(f"Error detaching stale handler for {phone}: {str(e)}")
+        self.clients[phone] = client
+        self.event_filters.pop(phone, None)
+        self._attach_handler(phone)
+        return True
+    def _refresh_filters(self):
+        for phone in list(self.handlers.keys()):
+            try:
+                self._attach_handler(phone)
+            except Exception as e:
+                logging.error(f"Error rebuilding event filter for {phone}: {str(e)}")
+    def _on_rules_changed(self, snapshot):
+        self._refresh_filters()
+    def set_chat_filters(self, allowlist=None, denylist=None):
+        self.chat_allowlist = set(allowlist or ())
+        self.chat_denylist = set(denylist or ())
+        self._refresh_filters()
+    def setup_handler(self, client, phone, delay_seconds=0.5, max_concurrent_chats=None):
+        if phone in self.handlers:
+            self.remove_handler(phone)
+        self.clients[phone] = client
         self.delays[phone] = delay_seconds
-        self.last_responses[phone] = {}
-        self.last_response_times[phone] = time.time()
-        self.message_queues[phone] = asyncio.Queue()
-        @client.on(events.NewMessage)
+        self.chat_lanes[phone] = {}
+        self.active_chats[phone] = set()
+        self.waiting_chats[phone] = {}
+        self.chat_limits[phone] = max_concurrent_chats or self.max_concurrent_chats
+        self.pending_counts[phone] = 0
+        self.shed_stats.setdefault(phone, {'dropped_newest': 0, 'dropped_oldest': 0, 'coalesced': 0})
         async def handle_new_message(event):
             try:
                 if not hasattr(event, 'message') or not hasattr(event.message, 'text'):
@@ -30,82 +139,224 @@ class MessageHandler:
                 is_private = event.is_private
                 should_respond = False
                 rule_matched = None
-                for rule_id, rule in self.rules_manager.get_all_rules().items():
-                    private_only = rule.get('private_only', False)
-                    if private_only and not is_private:
-                        continue
-                    if rule['keyword'].lower() in message_text.lower():
-                        should_respond = True
-                        rule_matched = rule_id
-                        all_responses = rule.get('responses', [])
-                        if not all_responses and 'response' in rule:
-                            all_responses = [rule['response']]
-                        if len(all_responses) <= 1:
-                            response_text = all_responses[0] if all_responses else ""
-                        else:
-                            recent_responses = self.last_responses.get(phone, {}).get(rule_id, [])
-                            available_responses = [r for r in all_responses if r not in recent_responses]
-                            if not available_responses:
-                                available_responses = all_responses
-                            response_text = random.choice(available_responses)
-                            if rule_id not in self.last_responses.get(phone, {}):
-                                self.last_responses[phone][rule_id] = []
-                            self.last_responses[phone][rule_id].append(response_text)
-                            if len(self.last_responses[phone][rule_id]) > 2:
-                                self.last_responses[phone][rule_id].pop(0)
-                        break
+                rule = self.rules_manager.get_snapshot().match(message_text, is_private)
+                if rule is not None:
+                    rule_id = rule_matched = rule.rule_id
+                    should_respond = True
+                    all_responses = rule.responses
+                    if len(all_responses) <= 1:
+                        response_text = all_responses[0] if all_responses else ""
+                    else:
+                        recent_responses = self.state.recent_responses(phone, rule_id)
+                        available_responses = [r for r in all_responses if r not in recent_responses]
+                        if not available_responses:
+                            available_responses = all_responses
+                        response_text = random.choice(available_responses)
+                        self.state.remember_response(phone, rule_id, response_text)
                 if should_respond and rule_matched and response_text:
                     current_time = time.time()
-                    time_since_last = current_time - self.last_response_times.get(phone, 0)
+                    time_since_last = current_time - self.state.last_reply_time(phone, event.chat_id)
                     extra_delay = 0
                     if time_since_last < 30:
                         extra_delay = random.uniform(10, 40)
-                    await self.message_queues[phone].put({'event': event, 'response': response_text, 'rule_id': rule_matched, 'extra_delay': extra_delay})
+                    # Keep only what the reply needs, not the whole Telethon event
+                    self._enqueue_reply(phone, {
+                        'chat_id': event.chat_id,
+                        'peer': self._reply_peer(phone, event),
+                        'sender_id': event.sender_id,
+                        'response': response_text,
+                        'rule_id': rule_matched,
+                        'extra_delay': extra_delay,
+                        'queued_at': current_time
+                    })
             except Exception as e:
                 logging.error(f"Error handling message: {str(e)}")
         self.handlers[phone] = handle_new_message
-        asyncio.create_task(self._process_message_queue(phone))
-    async def _process_message_queue(self, phone):
-        if phone not in self.message_queues:
+        self._attach_handler(phone)
+    def _reply_peer(self, phone, event):
+        # Input peer to answer in, so typing and sending need no resolve round-trip
+        peer = getattr(event, 'input_chat', None)
+        if self.entity_cache is not None:
+            if peer is not None:
+                self.entity_cache.remember(phone, peer)
+            else:
+                peer = self.entity_cache.input_peer(phone, event.chat_id)
+        return peer or event.chat_id
+    def _enqueue_reply(self, phone, item):
+        lanes = self.chat_lanes.get(phone)
+        if lanes is None:
+            return False
+        stats = self.shed_stats[phone]
+        chat_id = item['chat_id']
+        lane = lanes.get(chat_id)
+        if lane and self.overflow_policy == 'coalesce':
+            # A reply for this chat is already waiting; let it answer this trigger too
+            stats['coalesced'] += 1
+            return False
+        if lane is not None and len(lane) >= self.max_chat_queue:
+            if self.overflow_policy != 'drop_oldest':
+                stats['dropped_newest'] += 1
+                return False
+            lane.popleft()
+            self.pending_counts[phone] -= 1
+            stats['dropped_oldest'] += 1
+        if self.pending_counts[phone] >= self.max_account_queue:
+            if self.overflow_policy != 'drop_oldest' or not self._drop_oldest_pending(phone):
+                stats['dropped_newest'] += 1
+                return False
+            stats['dropped_oldest'] += 1
+        if lane is None:
+            lane = lanes[chat_id] = deque()
+        lane.append(item)
+        self.pending_counts[phone] += 1
+        self._activate_chat(phone, chat_id)
+        return True
+    def _drop_oldest_pending(self, phone):
+        oldest_lane = None
+        for lane in self.chat_lanes[phone].values():
+            if lane and (oldest_lane is None or lane[0]['queued_at'] < oldest_lane[0]['queued_at']):
+                oldest_lane = lane
+        if oldest_lane is None:
+            return False
+        oldest_lane.popleft()
+        self.pending_counts[phone] -= 1
+        return True
+    def get_queue_stats(self, phone=None):
+        phones = [phone] if phone else list(self.chat_lanes.keys())
+        scheduled = self.scheduler.backlog()['by_phone']
+        return {
+            p: {
+                'pending': self.pending_counts.get(p, 0),
+                'chats': len(self.chat_lanes.get(p, {})),
+                'scheduled': scheduled.get(p, 0),
+                **self.shed_stats.get(p, {'dropped_newest': 0, 'dropped_oldest': 0, 'coalesced': 0})
+            }
+            for p in phones
+        }
+    def get_scheduler_backlog(self):
+        return self.scheduler.backlog()
+    def _activate_chat(self, phone, chat_id):
+        # A chat has at most one reply in flight, which keeps replies in order
+        # inside a conversation while different chats wait and type in parallel
+        active = self.active_chats[phone]
+        if chat_id in active:
             return
-        queue = self.message_queues[phone]
+        if len(active) >= self.chat_limits[phone]:
+            self.waiting_chats[phone][chat_id] = True
+            return
+        active.add(chat_id)
+        self._start_next_reply(phone, chat_id)
+    def _release_chat(self, phone, chat_id):
+        self.active_chats[phone].discard(chat_id)
+        lanes = self.chat_lanes[phone]
+        if chat_id in lanes and not lanes[chat_id]:
+            del lanes[chat_id]
+        waiting = self.waiting_chats[phone]
+        while waiting and len(self.active_chats[phone]) < self.chat_limits[phone]:
+            next_chat = next(iter(waiting))
+            del waiting[next_chat]
+            if lanes.get(next_chat):
+                self._activate_chat(phone, next_chat)
+            else:
+                lanes.pop(next_chat, None)
+    def _start_next_reply(self, phone, chat_id):
+        lane = self.chat_lanes[phone].get(chat_id)
+        if not lane:
+            self._release_chat(phone, chat_id)
+            return
+        item = lane.popleft()
+        self.pending_counts[phone] -= 1
+        client = self.clients[phone]
+        extra_delay = item.get('extra_delay', 0)
         base_delay_seconds = self.delays.get(phone, 0.5)
-        while phone in self.message_queues:
+        delay_variation = random.uniform(0.5, 1.5)
+        actual_delay = base_delay_seconds * delay_variation + extra_delay
+        logging.info(f"Phone {phone}: Waiting {actual_delay:.2f}s before responding (base: {base_delay_seconds:.2f}s, extra: {extra_delay:.2f}s)")
+        self.scheduler.schedule(actual_delay, phone,
+                                lambda: self._start_typing(phone, chat_id, client, item, actual_delay))
+    def configure_rate_limits(self, **limits):
+        self.rate_limiter.configure(**limits)
+    def get_rate_stats(self):
+        return self.rate_limiter.stats()
+    @asynccontextmanager
+    async def _connected(self, phone):
+        if self.connector is None:
+            yield
+            return
+        async with self.connector(phone):
+            yield
+    async def _send_typing(self, phone, client, peer):
+        if self.rate_limiter.paused_for(phone):
+            return
+        try:
+            async with self._connected(phone):
+                await client(SetTypingRequest(peer=peer, action=SendMessageTypingAction()))
+        except FloodWaitError as e:
+            self.rate_limiter.pause_account(phone, e.seconds)
+            logging.warning(f"Phone {phone}: FloodWait {e.seconds}s on typing action, pausing account")
+        except Exception as e:
+            logging.debug(f"Could not send typing action to {peer}: {str(e)}")
+    async def _start_typing(self, phone, chat_id, client, item, actual_delay):
+        if self.clients.get(phone) is not client:
+            return
+        typing_duration = min(len(item['response']) / 5, 10)
+        typing_duration *= random.uniform(0.8, 1.2)
+        await self._send_typing(phone, client, item['peer'])
+        refresh_at = TYPING_REFRESH_SECONDS
+        while refresh_at < typing_duration:
+            self.scheduler.schedule(refresh_at, phone, lambda: self._refresh_typing(phone, client, item))
+            refresh_at += TYPING_REFRESH_SECONDS
+        self.scheduler.schedule(typing_duration + 0.5, phone,
+                                lambda: self._deliver_reply(phone, chat_id, client, item, actual_delay, typing_duration))
+    async def _refresh_typing(self, phone, client, item):
+        if self.clients.get(phone) is client:
+            await self._send_typing(phone, client, item['peer'])
+    def _retry_delivery(self, wait, phone, chat_id, client, item, actual_delay, typing_duration):
+        self.scheduler.schedule(wait, phone,
+                                lambda: self._deliver_reply(phone, chat_id, client, item, actual_delay, typing_duration))
+    async def _deliver_reply(self, phone, chat_id, client, item, actual_delay, typing_duration):
+        if self.clients.get(phone) is not client:
+            return
+        wait = self.rate_limiter.reserve(phone, chat_id)
+        if wait:
+            # Stay in flight for this chat so later replies keep their order
+            self._retry_delivery(wait, phone, chat_id, client, item, actual_delay, typing_duration)
+            return
+        try:
+            async with self._connected(phone):
+                await client.send_message(item['peer'], item['response'])
+            logging.info(f"Auto respond to {item['sender_id']} with rule {item['rule_id']} (delay: {actual_delay:.2f}s, typing: {typing_duration:.2f}s)")
+            self.state.record_reply(phone, chat_id)
+        except FloodWaitError as e:
+            # Only this account waits; every other account keeps sending
+            self.rate_limiter.pause_account(phone, e.seconds)
+            logging.warning(f"Phone {phone}: FloodWait {e.seconds}s, pausing account and retrying reply")
+            self._retry_delivery(e.seconds, phone, chat_id, client, item, actual_delay, typing_duration)
+            return
+        except Exception as e:
+            logging.error(f"Error sending reply in chat {chat_id} for {phone}: {str(e)}")
+        if self.clients.get(phone) is client:
+            self._start_next_reply(phone, chat_id)
+    def remove_handler(self, phone):
+        handler = self.handlers.pop(phone, None)
+        client = self.clients.pop(phone, None)
+        self.event_filters.pop(phone, None)
+        if handler and client:
             try:
-                try:
-                    item = await asyncio.wait_for(queue.get(), timeout=1.0)
-                except asyncio.TimeoutError:
-                    continue
-                event = item['event']
-                response = item['response']
-                rule_id = item['rule_id']
-                extra_delay = item.get('extra_delay', 0)
-                delay_variation = random.uniform(0.5, 1.5)
-                actual_delay = base_delay_seconds * delay_variation + extra_delay
-                logging.info(f"Phone {phone}: Waiting {actual_delay:.2f}s before responding (base: {base_delay_seconds:.2f}s, extra: {extra_delay:.2f}s)")
-                await asyncio.sleep(actual_delay)
-                typing_duration = min(len(response) / 5, 10)
-                typing_duration *= random.uniform(0.8, 1.2)
-                async with event.client.action(event.chat_id, 'typing'):
-                    await asyncio.sleep(typing_duration)
-                await asyncio.sleep(0.5)
-                await event.respond(response)
-                logging.info(f"Auto respond to {event.sender_id} with rule {rule_id} (delay: {actual_delay:.2f}s, typing: {typing_duration:.2f}s)")
-                self.last_response_times[phone] = time.time()
-                queue.task_done()
-            except asyncio.CancelledError:
-                break
+                client.remove_event_handler(handler, events.NewMessage)
             except Exception as e:
-                logging.error(f"Error processing message queue: {str(e)}")
-                await asyncio.sleep(1)
-    def remove_handler(self, phone):
-        if phone in self.handlers:
-            del self.handlers[phone]
-        if phone in self.message_queues:
-            del self.message_queues[phone]
+                logging.error(f"Error detaching handler for {phone}: {str(e)}")
+        self.scheduler.cancel_account(phone)
+        self.rate_limiter.remove_account(phone)
+        if phone in self.chat_lanes:
+            del self.chat_lanes[phone]
+        if phone in self.active_chats:
+            del self.active_chats[phone]
+        if phone in self.waiting_chats:
+            del self.waiting_chats[phone]
+        if phone in self.chat_limits:
+            del self.chat_limits[phone]
+        if phone in self.pending_counts:
+            del self.pending_counts[phone]
         if phone in self.delays:
             del self.delays[phone]
-        if phone in self.last_responses:
-            del self.last_responses[phone]
-        if phone in self.last_response_times:
-            del self.last_response_times[phone]
\ No newline at end of file
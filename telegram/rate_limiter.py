@@ -0,0 +1,110 @@
+# telegram/rate_limiter.py
+import time
+
+from .responder_state import TTLCache
+
+# Default of configure(): keep the current value, since None already means "disabled"
+_KEEP = object()
+
+class TokenBucket:
+    # Classic token bucket: rate tokens per second, holding at most capacity
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        # Seconds until one token is available (0 if one is available now)
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+class RateLimiter:
+    # reserve() takes a token from every bucket that applies or none at all; a rate of None disables that level
+    def __init__(self, global_rate=30, global_burst=30, account_rate=20 / 60, account_burst=5,
+                 chat_rate=6 / 60, chat_burst=2, max_chat_buckets=50000):
+        self.max_chat_buckets = max_chat_buckets
+        self.paused_until = {}
+        self.flood_waits = {}
+        self.limited = 0
+        self.configure(global_rate, global_burst, account_rate, account_burst, chat_rate, chat_burst)
+
+    def configure(self, global_rate=_KEEP, global_burst=_KEEP, account_rate=_KEEP, account_burst=_KEEP,
+                  chat_rate=_KEEP, chat_burst=_KEEP):
+        # (Re)build the buckets from the given limits, keeping omitted ones; FloodWait pauses are kept
+        def pick(value, name):
+            return getattr(self, name) if value is _KEEP else value
+        self.global_rate, self.global_burst = pick(global_rate, 'global_rate'), pick(global_burst, 'global_burst') or 1
+        self.account_rate, self.account_burst = pick(account_rate, 'account_rate'), pick(account_burst, 'account_burst') or 1
+        self.chat_rate, self.chat_burst = pick(chat_rate, 'chat_rate'), pick(chat_burst, 'chat_burst') or 1
+        self.global_bucket = TokenBucket(self.global_rate, self.global_burst) if self.global_rate else None
+        self.account_buckets = {}
+        self.chat_buckets = TTLCache(self.max_chat_buckets, 3600)
+
+    def pause_account(self, phone, seconds):
+        until = time.monotonic() + seconds
+        if until > self.paused_until.get(phone, 0):
+            self.paused_until[phone] = until
+        self.flood_waits[phone] = self.flood_waits.get(phone, 0) + 1
+
+    def paused_for(self, phone):
+        remaining = self.paused_until.get(phone, 0) - time.monotonic()
+        if remaining <= 0:
+            self.paused_until.pop(phone, None)
+            return 0
+        return remaining
+
+    def _buckets(self, phone, chat_id):
+        buckets = []
+        if self.global_bucket:
+            buckets.append(self.global_bucket)
+        if self.account_rate:
+            bucket = self.account_buckets.get(phone)
+            if bucket is None:
+                bucket = self.account_buckets[phone] = TokenBucket(self.account_rate, self.account_burst)
+            buckets.append(bucket)
+        if self.chat_rate:
+            bucket = self.chat_buckets.get((phone, chat_id))
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self.chat_buckets.set((phone, chat_id), bucket)
+            buckets.append(bucket)
+        return buckets
+
+    def reserve(self, phone, chat_id):
+        wait = self.paused_for(phone)
+        if wait:
+            return wait
+        now = time.monotonic()
+        buckets = self._buckets(phone, chat_id)
+        wait = max((bucket.delay(now) for bucket in buckets), default=0)
+        if wait:
+            self.limited += 1
+            return wait
+        for bucket in buckets:
+            bucket.consume(now)
+        return 0
+
+    def remove_account(self, phone):
+        self.account_buckets.pop(phone, None)
+        self.paused_until.pop(phone, None)
+        self.flood_waits.pop(phone, None)
+
+    def stats(self):
+        return {
+            'paused_accounts': {phone: round(remaining, 1) for phone in list(self.paused_until)
+                                if (remaining := self.paused_for(phone))},
+            'flood_waits': dict(self.flood_waits),
+            'limited': self.limited
+        }
@@ -0,0 +1,104 @@
+# telegram/reply_scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+class ReplyScheduler:
+    # One heap and one timer task for every delayed action, instead of a sleeping coroutine each
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._counts = {}
+        self._running = set()
+        self._wakeup = None
+        self._task = None
+        self.fired = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        # Wait for in-flight sends to unwind before their clients are disconnected
+        await asyncio.gather(*running, return_exceptions=True)
+        self._task = None
+
+    def schedule(self, delay, phone, callback):
+        # Run callback() (a coroutine function) for phone after delay seconds
+        due = time.monotonic() + max(delay, 0)
+        heapq.heappush(self._heap, (due, next(self._seq), phone, callback))
+        self._counts[phone] = self._counts.get(phone, 0) + 1
+        # Only the runner needs to know when the earliest entry changed
+        if self._wakeup is not None and self._heap[0][0] == due:
+            self._wakeup.set()
+        self.start()
+        return due
+
+    def cancel_account(self, phone):
+        # Drop every scheduled entry of an account; returns how many were dropped
+        dropped = self._counts.pop(phone, 0)
+        if dropped:
+            self._heap = [entry for entry in self._heap if entry[2] != phone]
+            heapq.heapify(self._heap)
+        return dropped
+
+    def backlog(self):
+        now = time.monotonic()
+        next_due = self._heap[0][0] - now if self._heap else None
+        return {
+            'scheduled': len(self._heap),
+            'overdue': sum(1 for entry in self._heap if entry[0] <= now),
+            'running': len(self._running),
+            'next_due_in': max(next_due, 0) if next_due is not None else None,
+            'by_phone': dict(self._counts),
+            'fired': self.fired,
+            'failed': self.failed
+        }
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, seq, phone, callback = heapq.heappop(self._heap)
+                remaining = self._counts.get(phone, 0) - 1
+                if remaining > 0:
+                    self._counts[phone] = remaining
+                else:
+                    self._counts.pop(phone, None)
+                task = asyncio.create_task(self._fire(phone, callback))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _fire(self, phone, callback):
+        try:
+            self.fired += 1
+            await callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Scheduled action for {phone} failed: {str(e)}")
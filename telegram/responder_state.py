@@ -0,0 +1,83 @@
+# telegram/responder_state.py
+import time
+from collections import OrderedDict, deque
+
+class TTLCache:
+    # LRU map whose entries also expire ttl seconds after their last use
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        touched_at, value = entry
+        now = time.monotonic()
+        if now - touched_at > self.ttl:
+            del self._data[key]
+            self.expired += 1
+            return default
+        self._data[key] = (now, value)
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        self._trim()
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else default
+
+    def _trim(self):
+        data = self._data
+        while len(data) > self.max_entries:
+            data.popitem(last=False)
+            self.evicted += 1
+        cutoff = time.monotonic() - self.ttl
+        while data:
+            touched_at, _ = next(iter(data.values()))
+            if touched_at > cutoff:
+                break
+            data.popitem(last=False)
+            self.expired += 1
+
+class ResponderState:
+    # Per-account, per-chat and per-rule responder memory with bounded size
+    def __init__(self, max_chats=50000, chat_ttl=6 * 3600, max_rules=20000, rule_ttl=24 * 3600,
+                 recent_responses=2):
+        self.chat_replies = TTLCache(max_chats, chat_ttl)
+        self.rule_responses = TTLCache(max_rules, rule_ttl)
+        self.recent_size = recent_responses
+
+    def last_reply_time(self, phone, chat_id):
+        return self.chat_replies.get((phone, chat_id), 0)
+
+    def record_reply(self, phone, chat_id, timestamp=None):
+        self.chat_replies.set((phone, chat_id), timestamp if timestamp is not None else time.time())
+
+    def recent_responses(self, phone, rule_id):
+        return self.rule_responses.get((phone, rule_id), ())
+
+    def remember_response(self, phone, rule_id, response):
+        recent = self.rule_responses.get((phone, rule_id))
+        if recent is None:
+            recent = deque(maxlen=self.recent_size)
+        recent.append(response)
+        self.rule_responses.set((phone, rule_id), recent)
+
+    def stats(self):
+        return {
+            'chats': len(self.chat_replies),
+            'rules': len(self.rule_responses),
+            'evicted': self.chat_replies.evicted + self.rule_responses.evicted,
+            'expired': self.chat_replies.expired + self.rule_responses.expired
+        }
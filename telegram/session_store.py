@@ -0,0 +1,323 @@
+# telegram/session_store.py
+# Shared Telethon session storage for all accounts in one SQLite database
+# Migrate existing session files with: python -m telegram.session_store [session directory]
+import datetime
+import glob
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.tl import types
+
+SESSION_STORE_PATH = 'session/sessions.db'
+# Position of a lookup column in a queued entities row (owner, id, hash, username, phone, name, date)
+_ENTITY_COLUMNS = {'username': 3, 'phone': 4, 'name': 5}
+
+class SessionStore:
+    # Writes are committed in batches by a background thread so Telethon callbacks never wait on SQLite
+    def __init__(self, path=SESSION_STORE_PATH, batch_size=500, flush_interval=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self.read_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.pending_sessions = {}
+        self.pending_entities = {}
+        self.pending_states = {}
+        # Rows taken by a running flush stay visible to lookups until they are committed
+        self.inflight = None
+        self.flushes = 0
+        self._flush_requested = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='session-store-flush', daemon=True)
+        self._flusher.start()
+    def _create_tables(self):
+        with self.conn:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    phone TEXT PRIMARY KEY,
+                    dc_id INTEGER,
+                    server_address TEXT,
+                    port INTEGER,
+                    auth_key BLOB,
+                    takeout_id INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS entities (
+                    owner TEXT,
+                    id INTEGER,
+                    hash INTEGER NOT NULL,
+                    username TEXT,
+                    phone INTEGER,
+                    name TEXT,
+                    date INTEGER,
+                    PRIMARY KEY (owner, id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_entities_username ON entities (owner, username);
+                CREATE INDEX IF NOT EXISTS idx_entities_phone ON entities (owner, phone);
+                CREATE TABLE IF NOT EXISTS update_state (
+                    owner TEXT,
+                    id INTEGER,
+                    pts INTEGER,
+                    qts INTEGER,
+                    date INTEGER,
+                    seq INTEGER,
+                    PRIMARY KEY (owner, id)
+                );
+            ''')
+    def pending(self):
+        return len(self.pending_sessions) + len(self.pending_entities) + len(self.pending_states)
+    def _maybe_flush(self):
+        if self.pending() >= self.batch_size:
+            self._flush_requested.set()
+    def request_flush(self):
+        # Ask the background thread to commit now, without waiting for it
+        self._flush_requested.set()
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            if not self._closed.is_set():
+                self.flush()
+    def queue_session(self, phone, dc_id, server_address, port, auth_key, takeout_id):
+        with self.lock:
+            self.pending_sessions[phone] = (phone, dc_id, server_address, port, auth_key, takeout_id)
+            self._maybe_flush()
+    def queue_entities(self, phone, rows):
+        now = int(time.time())
+        with self.lock:
+            for row in rows:
+                self.pending_entities[(phone, row[0])] = (phone, *row, now)
+            self._maybe_flush()
+    def queue_update_state(self, phone, entity_id, state):
+        with self.lock:
+            self.pending_states[(phone, entity_id)] = (phone, entity_id, state.pts, state.qts,
+                                                       int(state.date.timestamp()), state.seq)
+            self._maybe_flush()
+    def flush(self):
+        # Commit every queued row; runs on the flusher thread except at shutdown and migration
+        with self.write_lock:
+            with self.lock:
+                if not self.pending():
+                    return 0
+                batch = (self.pending_sessions, self.pending_entities, self.pending_states)
+                self.pending_sessions, self.pending_entities, self.pending_states = {}, {}, {}
+                self.inflight = batch
+            sessions, entities, states = batch
+            try:
+                with self.conn:
+                    self.conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                                          list(sessions.values()))
+                    self.conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                          list(entities.values()))
+                    self.conn.executemany("INSERT OR REPLACE INTO update_state VALUES (?, ?, ?, ?, ?, ?)",
+                                          list(states.values()))
+            except sqlite3.Error as e:
+                logging.error(f"Error flushing session store: {str(e)}")
+                with self.lock:
+                    # Rows queued meanwhile are newer, so they win over the failed batch
+                    for pending, failed in zip((self.pending_sessions, self.pending_entities, self.pending_states),
+                                               batch):
+                        for key, row in failed.items():
+                            pending.setdefault(key, row)
+                    self.inflight = None
+                return 0
+            with self.lock:
+                self.inflight = None
+            self.flushes += 1
+            return len(sessions) + len(entities) + len(states)
+    def _queued(self, index):
+        # Queued rows first, then the batch being committed
+        sources = [(self.pending_sessions, self.pending_entities, self.pending_states)[index]]
+        if self.inflight:
+            sources.append(self.inflight[index])
+        return sources
+    def _query(self, query, params):
+        with self.lock:
+            return self.read_conn.execute(query, params).fetchall()
+    def has_session(self, phone):
+        with self.lock:
+            return any(phone in rows for rows in self._queued(0)) or bool(
+                self._query("SELECT 1 FROM sessions WHERE phone = ?", (phone,)))
+    def load(self, phone):
+        # Return (session row or None, {entity_id: update state row}) for phone
+        with self.lock:
+            queued = next((rows[phone] for rows in self._queued(0) if phone in rows), None)
+            rows = [queued] if queued else self._query("SELECT * FROM sessions WHERE phone = ?", (phone,))
+            states = {row[0]: row[1:] for row in self._query(
+                "SELECT id, pts, qts, date, seq FROM update_state WHERE owner = ?", (phone,))}
+            for pending in reversed(self._queued(2)):
+                for (owner, entity_id), row in pending.items():
+                    if owner == phone:
+                        states[entity_id] = row[2:]
+            return (rows[0] if rows else None), states
+    def entity_by(self, phone, column, value):
+        position = _ENTITY_COLUMNS[column]
+        with self.lock:
+            for pending in self._queued(1):
+                matches = [row for (owner, _), row in pending.items() if owner == phone and row[position] == value]
+                if matches:
+                    newest = max(matches, key=lambda row: row[6])
+                    return newest[1], newest[2]
+            rows = self._query(f"SELECT id, hash FROM entities WHERE owner = ? AND {column} = ? "
+                               f"ORDER BY date DESC LIMIT 1", (phone, value))
+            return rows[0] if rows else None
+    def entity_by_ids(self, phone, ids):
+        with self.lock:
+            for pending in self._queued(1):
+                for entity_id in ids:
+                    row = pending.get((phone, entity_id))
+                    if row:
+                        return row[1], row[2]
+            placeholders = ', '.join('?' * len(ids))
+            rows = self._query(f"SELECT id, hash FROM entities WHERE owner = ? AND id IN ({placeholders})",
+                               (phone, *ids))
+            return rows[0] if rows else None
+    def delete(self, phone):
+        with self.write_lock:
+            with self.lock:
+                self.pending_sessions.pop(phone, None)
+                for key in [key for key in self.pending_entities if key[0] == phone]:
+                    del self.pending_entities[key]
+                for key in [key for key in self.pending_states if key[0] == phone]:
+                    del self.pending_states[key]
+            with self.conn:
+                self.conn.execute("DELETE FROM sessions WHERE phone = ?", (phone,))
+                self.conn.execute("DELETE FROM entities WHERE owner = ?", (phone,))
+                self.conn.execute("DELETE FROM update_state WHERE owner = ?", (phone,))
+    def _read_session_file(self, path, phone):
+        source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            session = source.execute(
+                "SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchone()
+            if session is None or session[3] is None:
+                return None
+            entities = [(phone, *row) for row in source.execute(
+                "SELECT id, hash, username, phone, name, date FROM entities")]
+            try:
+                states = [(phone, *row) for row in source.execute(
+                    "SELECT id, pts, qts, date, seq FROM update_state")]
+            except sqlite3.OperationalError:
+                # Very old session files have no update_state table
+                states = []
+            return (phone, *session), entities, states
+        finally:
+            source.close()
+    def import_session_file(self, path, phone=None):
+        return self.import_session_files([path], {path: phone})['migrated'] == 1
+    def import_session_files(self, paths, phones=None, batch_files=200):
+        # Bulk-import Telethon *.session files, batch_files files per transaction
+        phones = phones or {}
+        result = {'migrated': 0, 'skipped': 0, 'failed': 0}
+        self.flush()
+        for start in range(0, len(paths), batch_files):
+            sessions, entities, states = [], [], []
+            for path in paths[start:start + batch_files]:
+                phone = phones.get(path) or os.path.splitext(os.path.basename(path))[0]
+                try:
+                    data = self._read_session_file(path, phone)
+                except sqlite3.Error as e:
+                    logging.error(f"Cannot read session file {path}: {str(e)}")
+                    result['failed'] += 1
+                    continue
+                if data is None:
+                    result['skipped'] += 1
+                    continue
+                sessions.append(data[0])
+                entities.extend(data[1])
+                states.extend(data[2])
+            with self.write_lock, self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)", sessions)
+                self.conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)", entities)
+                self.conn.executemany("INSERT OR REPLACE INTO update_state VALUES (?, ?, ?, ?, ?, ?)", states)
+            result['migrated'] += len(sessions)
+        return result
+    def migrate_directory(self, directory='session'):
+        paths = sorted(glob.glob(os.path.join(directory, '*.session')))
+        return self.import_session_files(paths)
+    def close(self):
+        self._closed.set()
+        self._flush_requested.set()
+        self._flusher.join()
+        self.flush()
+        with self.write_lock, self.lock:
+            self.conn.close()
+            self.read_conn.close()
+
+def open_session_store(path=SESSION_STORE_PATH):
+    # The shared store is used once it exists, i.e. after running the migration
+    return SessionStore(path) if os.path.exists(path) else None
+
+class StoredSession(MemorySession):
+    # Telethon session for one phone whose data lives in a shared SessionStore
+    def __init__(self, store, phone):
+        super().__init__()
+        self.store = store
+        self.phone = phone
+        row, states = store.load(phone)
+        if row:
+            _, self._dc_id, self._server_address, self._port, key, self._takeout_id = row
+            if key:
+                self._auth_key = AuthKey(data=key)
+        for entity_id, (pts, qts, date, seq) in states.items():
+            self._update_states[entity_id] = types.updates.State(
+                pts, qts, datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc), seq, unread_count=0
+            )
+    def _queue_session(self):
+        key = self._auth_key.key if self._auth_key else None
+        self.store.queue_session(self.phone, self._dc_id, self._server_address, self._port, key, self._takeout_id)
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._queue_session()
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._queue_session()
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._queue_session()
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self.store.queue_update_state(self.phone, entity_id, state)
+    def save(self):
+        self.store.request_flush()
+    def close(self):
+        self.store.request_flush()
+    def delete(self):
+        self.store.delete(self.phone)
+    def process_entities(self, tlo):
+        rows = self._entities_to_rows(tlo)
+        if rows:
+            self.store.queue_entities(self.phone, rows)
+    def get_entity_rows_by_phone(self, phone):
+        return self.store.entity_by(self.phone, 'phone', phone)
+    def get_entity_rows_by_username(self, username):
+        return self.store.entity_by(self.phone, 'username', username)
+    def get_entity_rows_by_name(self, name):
+        return self.store.entity_by(self.phone, 'name', name)
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            ids = (id,)
+        else:
+            ids = (utils.get_peer_id(types.PeerUser(id)), utils.get_peer_id(types.PeerChat(id)),
+                   utils.get_peer_id(types.PeerChannel(id)))
+        return self.store.entity_by_ids(self.phone, ids)
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'session'
+    store = SessionStore(os.path.join(directory, os.path.basename(SESSION_STORE_PATH)))
+    result = store.migrate_directory(directory)
+    store.close()
+    print(f"Migrasi selesai: {result['migrated']} berhasil, {result['skipped']} dilewati, "
+          f"{result['failed']} gagal")
@@ -0,0 +1,324 @@
+# telegram/worker_pool.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import time
+
+from rules.snapshot import RuleSnapshot
+
+from .client_manager import ClientManager
+from .client_supervisor import ClientSupervisor
+from .entity_cache import EntityCache
+from .health_monitor import HealthMonitor
+from .message_handler import MessageHandler
+from .session_store import open_session_store
+
+# Seconds between event loop lag samples inside a worker
+LAG_SAMPLE_INTERVAL = 0.5
+
+class RulesMirror:
+    # Read-only RulesManager stand-in inside a worker; the coordinator pushes rules with apply()
+    def __init__(self, rules=None, version=0):
+        self.snapshot = RuleSnapshot(rules or {}, version)
+        self.snapshot_listeners = []
+    def add_snapshot_listener(self, callback):
+        self.snapshot_listeners.append(callback)
+    def get_snapshot(self):
+        return self.snapshot
+    def apply(self, rules, version):
+        self.snapshot = RuleSnapshot(rules, version)
+        for callback in self.snapshot_listeners:
+            try:
+                callback(self.snapshot)
+            except Exception as e:
+                logging.error(f"Error in rules snapshot listener: {str(e)}")
+
+class ResponderWorker:
+    # One worker process: its own event loop, ClientManager and MessageHandler
+    def __init__(self, worker_id, conn, rules, version):
+        self.worker_id = worker_id
+        self.conn = conn
+        self.rules = RulesMirror(rules, version)
+        self.loop_lag = 0
+        self.max_loop_lag = 0
+
+    async def run(self):
+        self.session_store = open_session_store()
+        self.client_manager = ClientManager(session_store=self.session_store)
+        self.entity_cache = EntityCache()
+        self.message_handler = MessageHandler(self.rules, entity_cache=self.entity_cache,
+                                              connector=self.client_manager.connected)
+        self.client_manager.add_disconnect_listener(self.message_handler.remove_handler)
+        self.supervisor = ClientSupervisor(self.client_manager, self.message_handler)
+        self.supervisor.start()
+        self.health_monitor = HealthMonitor(self.client_manager)
+        self.health_monitor.start()
+        lag_task = asyncio.create_task(self._sample_lag())
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    message = await loop.run_in_executor(None, self.conn.recv)
+                except (EOFError, OSError):
+                    logging.warning(f"Worker {self.worker_id} lost its coordinator, shutting down")
+                    break
+                op = message.pop('op')
+                try:
+                    result = await getattr(self, f'_op_{op}')(**message)
+                    self.conn.send({'result': result})
+                except Exception as e:
+                    logging.error(f"Worker {self.worker_id} failed '{op}': {str(e)}")
+                    self.conn.send({'error': str(e) or e.__class__.__name__})
+                if op == 'shutdown':
+                    break
+        finally:
+            lag_task.cancel()
+            await self.supervisor.stop()
+            await self.health_monitor.stop()
+            await self.message_handler.scheduler.stop()
+            await self.client_manager.disconnect_all_clients()
+            if self.session_store is not None:
+                self.session_store.close()
+            self.entity_cache.close()
+
+    async def _sample_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            self.loop_lag = max(time.monotonic() - started - LAG_SAMPLE_INTERVAL, 0)
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+
+    async def _op_activate(self, accounts, max_connections, ramp_rate, rate_limits=None, connection_cap=None,
+                           on_demand=False):
+        self.client_manager.max_open_connections = connection_cap
+        # Each worker only warms the peers of the accounts it runs
+        self.entity_cache.load([account[2] for account, _ in accounts])
+        self.entity_cache.start()
+        if rate_limits:
+            self.message_handler.configure_rate_limits(**rate_limits)
+        semaphore = asyncio.Semaphore(max_connections or len(accounts))
+        interval = 1 / ramp_rate if ramp_rate else 0
+        start = time.monotonic()
+        return await asyncio.gather(*(
+            self.client_manager.activate_account(account, self.message_handler, delay, semaphore, start + i * interval,
+                                                 on_demand=on_demand)
+            for i, (account, delay) in enumerate(accounts)
+        ))
+
+    async def _op_stop(self, phones=None):
+        phones = list(self.client_manager.active_clients) if phones is None else phones
+        for phone in phones:
+            await self.client_manager.disconnect_client(phone)
+        return phones
+
+    async def _op_rules(self, rules, version):
+        self.rules.apply(rules, version)
+        return version
+
+    async def _op_chat_filters(self, allowlist, denylist):
+        self.message_handler.set_chat_filters(allowlist, denylist)
+        return True
+
+    async def _op_stats(self):
+        return {
+            'worker': self.worker_id,
+            'pid': os.getpid(),
+            'active': list(self.client_manager.active_clients),
+            'connected': [phone for phone, client in self.client_manager.active_clients.items()
+                          if client.is_connected()],
+            'connections': self.client_manager.connection_stats(),
+            'rules_version': self.rules.snapshot.version,
+            'queues': self.message_handler.get_queue_stats(),
+            'backlog': self.message_handler.get_scheduler_backlog(),
+            'rate': self.message_handler.get_rate_stats(),
+            'reconnects': self.supervisor.stats(),
+            'entity_cache': self.entity_cache.stats(),
+            'health': self.health_monitor.all_summaries(),
+            'loop_lag_ms': round(self.loop_lag * 1000, 1),
+            'max_loop_lag_ms': round(self.max_loop_lag * 1000, 1)
+        }
+
+    async def _op_shutdown(self):
+        return True
+
+def _worker_main(worker_id, conn, rules, version):
+    from utils.helpers import setup_logging
+    setup_logging()
+    # Ctrl+C belongs to the coordinator, which shuts the workers down in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(ResponderWorker(worker_id, conn, rules, version).run())
+
+class WorkerPool:
+    # Spreads active accounts over worker processes, one event loop per CPU core
+    def __init__(self, rules_manager, workers=None, client_manager=None):
+        self.rules_manager = rules_manager
+        # The coordinator's own ClientManager, which must not open sessions a worker owns
+        self.client_manager = client_manager
+        self.size = max(workers or os.cpu_count() or 1, 1)
+        self.processes = []
+        self.conns = []
+        self.locks = []
+        self.assignments = {}
+        self.rules_manager.add_snapshot_listener(self._on_rules_changed)
+
+    @property
+    def running(self):
+        return bool(self.processes)
+
+    def start(self):
+        if self.running:
+            return
+        context = multiprocessing.get_context('spawn')
+        snapshot = self.rules_manager.get_snapshot()
+        for worker_id in range(self.size):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_main, name=f'responder-worker-{worker_id}',
+                                      args=(worker_id, child_conn, dict(self.rules_manager.rules), snapshot.version),
+                                      daemon=True)
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+            self.locks.append(asyncio.Lock())
+        logging.info(f"Started {self.size} responder worker processes")
+
+    @staticmethod
+    def _roundtrip(conn, message):
+        conn.send(message)
+        return conn.recv()
+
+    async def _request(self, index, op, **payload):
+        async with self.locks[index]:
+            reply = await asyncio.get_running_loop().run_in_executor(
+                None, self._roundtrip, self.conns[index], {'op': op, **payload}
+            )
+        if 'error' in reply:
+            raise RuntimeError(f"Worker {index}: {reply['error']}")
+        return reply['result']
+
+    def _on_rules_changed(self, snapshot):
+        if self.running:
+            asyncio.ensure_future(self._broadcast_rules(dict(self.rules_manager.rules), snapshot.version))
+
+    async def _broadcast_rules(self, rules, version):
+        results = await asyncio.gather(*(self._request(i, 'rules', rules=rules, version=version)
+                                         for i in range(self.size)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error(f"Failed to forward rules version {version}: {str(result)}")
+
+    def _assign(self, accounts):
+        loads = [0] * self.size
+        for index in self.assignments.values():
+            loads[index] += 1
+        batches = [[] for _ in range(self.size)]
+        for account in accounts:
+            index = loads.index(min(loads))
+            loads[index] += 1
+            batches[index].append(account)
+        return batches
+
+    async def activate(self, accounts, total_delay_seconds, max_connections, ramp_rate, rate_limits=None,
+                       connection_cap=None, on_demand=False, chat_filters=None):
+        # Activate accounts on the workers; returns [(phone, failure reason or None)]
+        self.start()
+        pending = [account for account in accounts if account[2] not in self.assignments]
+        results = []
+        if self.client_manager is not None:
+            # Two processes must never use one session at once, so pooled clients here are closed first
+            handed_off = []
+            for account in pending:
+                try:
+                    await self.client_manager.hand_off(account[2])
+                    handed_off.append(account)
+                except Exception as e:
+                    results.append((account[2], str(e)))
+            pending = handed_off
+        if not pending:
+            return results
+        if chat_filters is not None:
+            # Filters apply to every account, including the ones already running in a worker
+            await asyncio.gather(*(self._request(i, 'chat_filters', **chat_filters) for i in range(self.size)))
+        # Connection, ramp-up and global reply limits are fleet-wide, so each worker gets a share
+        share = rate_limits and dict(rate_limits)
+        if share and share.get('global_rate'):
+            share['global_rate'] /= self.size
+            share['global_burst'] = max(int(share['global_burst'] / self.size), 1)
+        worker_cap = connection_cap and max(connection_cap // self.size, 1)
+        worker_connections = max(int(max_connections / self.size), 1) if max_connections else 0
+        batches = self._assign(pending)
+        requests = []
+        for index, batch in enumerate(batches):
+            if not batch:
+                continue
+            delayed = [(tuple(account[:3]), total_delay_seconds / len(accounts) * random.uniform(0.8, 1.2))
+                       for account in batch]
+            requests.append((index, self._request(index, 'activate', accounts=delayed,
+                                                  max_connections=worker_connections,
+                                                  ramp_rate=ramp_rate / self.size if ramp_rate else 0,
+                                                  rate_limits=share,
+                                                  connection_cap=worker_cap,
+                                                  on_demand=on_demand)))
+        replies = await asyncio.gather(*(request for _, request in requests), return_exceptions=True)
+        for (index, _), reply in zip(requests, replies):
+            if isinstance(reply, Exception):
+                results.extend((account[2], str(reply)) for account in batches[index])
+                continue
+            for phone, reason in reply:
+                if reason is None:
+                    self.assignments[phone] = index
+                results.append((phone, reason))
+        for phone, reason in results:
+            if reason is not None:
+                self._take_back(phone)
+        return results
+
+    def _take_back(self, phone):
+        if self.client_manager is not None:
+            self.client_manager.take_back(phone)
+
+    async def stop_accounts(self, phones=None):
+        if not self.running:
+            return []
+        if phones is None:
+            targets = {index: None for index in range(self.size)}
+        else:
+            targets = {}
+            for phone in phones:
+                if phone in self.assignments:
+                    targets.setdefault(self.assignments[phone], []).append(phone)
+        stopped = []
+        for index, batch in targets.items():
+            stopped.extend(await self._request(index, 'stop', phones=batch))
+        for phone in stopped:
+            self.assignments.pop(phone, None)
+            self._take_back(phone)
+        return stopped
+
+    async def stats(self):
+        if not self.running:
+            return []
+        results = await asyncio.gather(*(self._request(i, 'stats') for i in range(self.size)),
+                                       return_exceptions=True)
+        return [result for result in results if not isinstance(result, Exception)]
+
+    async def shutdown(self, timeout=30):
+        if not self.running:
+            return
+        await asyncio.gather(*(self._request(i, 'shutdown') for i in range(self.size)), return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning(f"Worker {process.name} did not stop in time, terminating")
+                process.terminate()
+        for conn in self.conns:
+            conn.close()
+        self.processes, self.conns, self.locks = [], [], []
+        for phone in self.assignments:
+            self._take_back(phone)
+        self.assignments.clear()
+        logging.info("Responder worker processes stopped")
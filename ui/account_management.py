@@ -2,6 +2,8 @@
 import asyncio
 import logging
 import json  # Tambahkan baris ini
+import os
+from datetime import datetime
 
 from aioconsole import ainput
 from prettytable import PrettyTable
@@ -22,31 +24,29 @@ class AccountManagement:
                 print("Semua field harus diisi!")
                 return
 
-            client = await self.client_manager.create_client(int(api_id), api_hash, phone)
-
             async def code_callback():
                 return await ainput("Masukkan kode yang diterima: ")
 
-            me = await self.client_manager.authorize_client(client, phone,
-                                                            default_2fa="Dgvt61zwe@",
-                                                            code_callback=code_callback)
+            async with self.client_manager.lease(api_id, api_hash, phone, probe=True) as client:
+                me = await self.client_manager.authorize_client(client, phone,
+                                                                default_2fa="Dgvt61zwe@",
+                                                                code_callback=code_callback)
 
-            self.db_manager.add_account(api_id, api_hash, phone, "Dgvt61zwe@",
+            await self.db_manager.aadd_account(api_id, api_hash, phone, "Dgvt61zwe@",
                                      me.id, me.username, me.first_name)
 
             print(f"Akun {phone} berhasil ditambahkan!")
-            await client.disconnect()
         except Exception as e:
             logging.error(f"Gagal menambahkan akun: {str(e)}")
             print(f"Gagal menambahkan akun: {str(e)}")
 
-    def list_accounts(self):
+    async def list_accounts(self):
         """UI for listing all accounts with pagination support"""
         table = PrettyTable()
         table.field_names = ["API ID", "Phone", "User ID", "Username", "Name"]
 
         try:
-            accounts = self.db_manager.get_all_accounts()
+            accounts = await self.db_manager.aget_all_accounts()
             if not accounts:
                 print("Tidak ada akun yang tersimpan.")
                 return
@@ -63,33 +63,32 @@ class AccountManagement:
             api_id = await ainput("Masukkan API ID (kosongkan untuk semua): ")
             accounts = []
             if api_id.strip():
-                account = self.db_manager.get_account_by_api_id(api_id)
+                account = await self.db_manager.aget_account_by_api_id(api_id)
                 if account:
                     accounts = [account]
             else:
-                accounts = self.db_manager.get_all_accounts()
+                accounts = await self.db_manager.aget_all_accounts()
             if not accounts:
                 print("Tidak ada akun yang ditemukan!")
                 return
-            results = {}
+            results = []
             failed_accounts = []
-            for account in accounts:
-                api_id, api_hash, phone = account[0], account[1], account[2]
-                client = await self.client_manager.create_client(api_id, api_hash, phone)
-                result = await self.client_manager.test_connection(client, phone)
-                results[api_id] = result
-                if result['status'] != 'Berhasil':
+            print(f"Menguji {len(accounts)} akun secara paralel...")
+            async for account, result in self.client_manager.probe_accounts(accounts):
+                results.append(result)
+                print(f"[{len(results)}/{len(accounts)}] {result['phone']} (API ID: {result['api_id']}): "
+                      f"{result['status']} ({result['elapsed']}s)")
+                if result['error']:
+                    print(f"  Error: {result['error']}")
+                # Accounts running in a worker are skipped, their session belongs to that process
+                if result['status'] not in ('Berhasil', 'Dilewati'):
                     failed_accounts.append(account)
-                else:
-                    await client.disconnect()
-            print("Hasil uji koneksi:")
-            for api_id, info in results.items():
-                status = info['status']
-                phone = info['phone']
-                error = info['error']
-                print(f"- {phone} (API ID: {api_id}): {status}")
-                if error:
-                    print(f"  Error: {error}")
+            skipped = sum(1 for result in results if result['status'] == 'Dilewati')
+            summary_file = self._write_connection_summary(results)
+            print(f"\nBerhasil: {len(results) - len(failed_accounts) - skipped}, Gagal: {len(failed_accounts)}, "
+                  f"Dilewati: {skipped}")
+            if summary_file:
+                print(f"Ringkasan uji koneksi disimpan ke {summary_file}")
             if failed_accounts:
                 fix_all = await ainput("\nAda akun yang gagal. Perbaiki semua? (y/n): ")
                 if fix_all.lower() == 'y':
@@ -112,42 +111,59 @@ class AccountManagement:
             logging.error(f"Error during connection test: {str(e)}")
             print(f"Gagal melakukan uji koneksi: {str(e)}")
 
+    def _write_connection_summary(self, results):
+        """Write connection test results to logs/ for later triage"""
+        try:
+            os.makedirs('logs', exist_ok=True)
+            filename = os.path.join('logs', f"connection_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            status_counts = {}
+            for result in results:
+                status_counts[result['status']] = status_counts.get(result['status'], 0) + 1
+            summary = {
+                "timestamp": datetime.now().isoformat(),
+                "total": len(results),
+                "status_counts": status_counts,
+                "failed": [r for r in results if r['status'] not in ('Berhasil', 'Dilewati')],
+                "results": results
+            }
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=4)
+            return filename
+        except Exception as e:
+            logging.error(f"Gagal menyimpan ringkasan uji koneksi: {str(e)}")
+            return None
+
     async def _fix_failed_account(self, account):
         """Fix a failed account by requesting new code and saving session"""
         try:
             from telethon.errors import SessionPasswordNeededError
             api_id, api_hash, phone, twofa = account[0], account[1], account[2], account[3]
             print(f"\nMemperbaiki akun {phone}...")
-            client = await self.client_manager.create_client(int(api_id), api_hash, phone)
-            if not await client.is_user_authorized():
-                try:
-                    await client.send_code_request(phone)
-                    code = await ainput("Masukkan kode Telegram yang diterima: ")
+            async with self.client_manager.lease(api_id, api_hash, phone, probe=True) as client:
+                if not await client.is_user_authorized():
                     try:
-                        await client.sign_in(phone, code)
-                    except SessionPasswordNeededError:
-                        if twofa:
-                            await client.sign_in(password=twofa)
-                        else:
-                            password = await ainput("Masukkan password 2FA: ")
-                            await client.sign_in(password=password)
-                            self.db_manager.execute_query(
-                                "UPDATE accounts SET twofa=? WHERE api_id=?",
-                                (password, api_id),
-                                commit=True
-                            )
+                        await client.send_code_request(phone)
+                        code = await ainput("Masukkan kode Telegram yang diterima: ")
+                        try:
+                            await client.sign_in(phone, code)
+                        except SessionPasswordNeededError:
+                            if twofa:
+                                await client.sign_in(password=twofa)
+                            else:
+                                password = await ainput("Masukkan password 2FA: ")
+                                await client.sign_in(password=password)
+                                await self.db_manager.aupdate_twofa(api_id, password)
+                        me = await client.get_me()
+                        await self.db_manager.aupdate_account(api_id, me.id, me.username, me.first_name)
+                        print(f"Akun {phone} berhasil diperbaiki dan diperbarui!")
+                    except Exception as e:
+                        logging.error(f"Gagal memperbaiki akun {phone}: {str(e)}")
+                        print(f"Gagal memperbaiki akun {phone}: {str(e)}")
+                else:
+                    print(f"Akun {phone} sudah terotorisasi.")
                     me = await client.get_me()
-                    self.db_manager.update_account(api_id, me.id, me.username, me.first_name)
-                    print(f"Akun {phone} berhasil diperbaiki dan diperbarui!")
-                except Exception as e:
-                    logging.error(f"Gagal memperbaiki akun {phone}: {str(e)}")
-                    print(f"Gagal memperbaiki akun {phone}: {str(e)}")
-            else:
-                print(f"Akun {phone} sudah terotorisasi.")
-                me = await client.get_me()
-                self.db_manager.update_account(api_id, me.id, me.username, me.first_name)
-                print(f"Info akun {phone} berhasil diperbarui!")
-            await client.disconnect()
+                    await self.db_manager.aupdate_account(api_id, me.id, me.username, me.first_name)
+                    print(f"Info akun {phone} berhasil diperbarui!")
         except Exception as e:
             logging.error(f"Gagal memperbaiki akun: {str(e)}")
             print(f"Gagal memperbaiki akun: {str(e)}")
@@ -159,7 +175,7 @@ class AccountManagement:
             if not api_id.strip():
                 print("API ID tidak boleh kosong!")
                 return
-            result = self.db_manager.delete_account(api_id)
+            result = await self.db_manager.adelete_account(api_id)
             if result:
                 print(f"Akun {api_id} berhasil dihapus!")
             else:
@@ -175,15 +191,14 @@ class AccountManagement:
             if not api_id.strip():
                 print("API ID tidak boleh kosong!")
                 return
-            account = self.db_manager.get_account_by_api_id(api_id)
+            account = await self.db_manager.aget_account_by_api_id(api_id)
             if not account:
                 print(f"Akun dengan API ID {api_id} tidak ditemukan!")
                 return
             api_id, api_hash, phone = account[0], account[1], account[2]
-            client = await self.client_manager.create_client(int(api_id), api_hash, phone)
-            me = await self.client_manager.authorize_client(client, phone, default_2fa="Dgvt61zwe@")
-            self.db_manager.update_account(api_id, me.id, me.username, me.first_name)
-            await client.disconnect()
+            async with self.client_manager.lease(api_id, api_hash, phone, probe=True) as client:
+                me = await self.client_manager.authorize_client(client, phone, default_2fa="Dgvt61zwe@")
+            await self.db_manager.aupdate_account(api_id, me.id, me.username, me.first_name)
             print(f"Akun {phone} berhasil diperbarui!")
         except Exception as e:
             logging.error(f"Gagal memperbarui akun: {str(e)}")
@@ -196,7 +211,7 @@ class AccountManagement:
             if not filename.strip():
                 filename = "accounts_export.json"
 
-            accounts = self.db_manager.get_all_accounts()
+            accounts = await self.db_manager.aget_all_accounts()
             if not accounts:
                 print("Tidak ada akun untuk diekspor.")
                 return
@@ -214,7 +229,7 @@ class AccountManagement:
                     "name": name
                 })
 
-            total_accounts = self.db_manager.count_accounts()
+            total_accounts = await self.db_manager.acount_accounts()
             if len(account_list) != total_accounts:
                 print(f"PERINGATAN: Jumlah akun yang diekspor ({len(account_list)}) tidak sesuai dengan jumlah akun di database ({total_accounts})")
                 proceed = await ainput("Tetap lanjutkan ekspor? (y/n): ")
@@ -259,9 +274,6 @@ class AccountManagement:
                 print("Tidak ada akun untuk diimpor.")
                 return
 
-            accounts_before = self.db_manager.count_accounts()
-
-            success_count = 0
             fail_count = 0
             skip_count = 0
 
@@ -273,6 +285,7 @@ class AccountManagement:
                 accounts = accounts_list
 
             processed_phones = set()
+            rows = []
 
             for account in accounts:
                 try:
@@ -290,32 +303,31 @@ class AccountManagement:
                     username = account.get("username", None)
                     name = account.get("name", "auto")
 
-                    result = self.db_manager.add_account(
-                        api_id, api_hash, phone, twofa,
-                        user_id, username, name
-                    )
-
-                    if result:
-                        success_count += 1
-                        processed_phones.add(phone)
-                    else:
-                        fail_count += 1
-                        logging.warning(f"Gagal menambahkan akun {phone} ke database")
+                    rows.append((api_id, api_hash, phone, twofa, user_id, username, name))
+                    processed_phones.add(phone)
 
                 except Exception as e:
                     logging.error(f"Gagal mengimpor akun {account.get('phone', 'unknown')}: {str(e)}")
                     print(f"Gagal mengimpor akun {account.get('phone', 'unknown')}: {str(e)}")
                     fail_count += 1
 
-            accounts_after = self.db_manager.count_accounts()
-            actual_added = accounts_after - accounts_before
+            # Semua akun ditulis dalam satu transaksi
+            outcomes = await self.db_manager.aupsert_accounts(rows)
+            inserted = sum(1 for _, outcome in outcomes if outcome == 'inserted')
+            updated = sum(1 for _, outcome in outcomes if outcome == 'updated')
+            for phone, outcome in outcomes:
+                if outcome == 'failed':
+                    fail_count += 1
+                    logging.warning(f"Gagal menambahkan akun {phone} ke database")
+            success_count = inserted + updated
+            accounts_after = await self.db_manager.acount_accounts()
 
             print(f"\nRingkasan import dari {filename}:")
             print(f"Total akun dalam file: {len(accounts)}")
             print(f"Berhasil diimpor: {success_count}")
             print(f"Gagal diimpor: {fail_count}")
             print(f"Dilewati (duplikat): {skip_count}")
-            print(f"Tambahan akun di database: {actual_added}")
+            print(f"Tambahan akun di database: {inserted} (diperbarui: {updated})")
             print(f"\nTotal akun dalam database: {accounts_after}")
 
         except Exception as e:
@@ -54,13 +54,12 @@ class AnalyticsMenu:
             logging.error(f"Error saving analytics data: {str(e)}")
             return False
 
-    def _collect_current_analytics(self):
+    async def _collect_current_analytics(self):
         """Collect current analytics data from the system"""
         timestamp = datetime.now().isoformat()
         
         # Get account statistics
-        accounts = self.db_manager.get_all_accounts()
-        account_count = len(accounts)
+        account_count = await self.db_manager.acount_accounts()
         active_clients = len(self.client_manager.active_clients)
         
         # Collect additional metrics
@@ -172,7 +171,7 @@ class AnalyticsMenu:
         """Collect current analytics data"""
         try:
             print("Mengumpulkan data analitik terbaru...")
-            data = self._collect_current_analytics()
+            data = await self._collect_current_analytics()
             
             print("\nData berhasil dikumpulkan:")
             print(f"Timestamp: {datetime.fromisoformat(data['timestamp']).strftime('%Y-%m-%d %H:%M:%S')}")
@@ -188,7 +187,7 @@ class AnalyticsMenu:
         """Export daily analytics data to a JSON file"""
         try:
             # Collect current data before exporting
-            self._collect_current_analytics()
+            await self._collect_current_analytics()
             
             today = datetime.now().strftime('%Y-%m-%d')
             today_data = self.analytics_data["daily"].get(today, [])
@@ -253,7 +252,7 @@ class AnalyticsMenu:
         """Export weekly analytics data to a JSON file"""
         try:
             # Collect current data before exporting
-            self._collect_current_analytics()
+            await self._collect_current_analytics()
             
             current_week = datetime.now().strftime('%Y-W%W')
             week_data = self.analytics_data["weekly"].get(current_week, [])
@@ -319,7 +318,7 @@ class AnalyticsMenu:
         """Export monthly analytics data to a JSON file"""
         try:
             # Collect current data before exporting
-            self._collect_current_analytics()
+            await self._collect_current_analytics()
             
             current_month = datetime.now().strftime('%Y-%m')
             month_data = self.analytics_data["monthly"].get(current_month, [])
@@ -386,7 +385,7 @@ class AnalyticsMenu:
         """Generate various analytics charts"""
         try:
             # Collect current data
-            self._collect_current_analytics()
+            await self._collect_current_analytics()
             
             print("Generating analytics charts...")
             charts_generated = 0
@@ -484,7 +483,7 @@ class AnalyticsMenu:
         """View a simple analytics dashboard in the console"""
         try:
             # Collect current data
-            current_data = self._collect_current_analytics()
+            current_data = await self._collect_current_analytics()
             
             print("\n==== ANALYTICS DASHBOARD ====")
             print(f"Timestamp: {datetime.fromisoformat(current_data['timestamp']).strftime('%Y-%m-%d %H:%M:%S')}")
@@ -1,16 +1,29 @@
 # ui/auto_responder.py
 import asyncio
 import logging
+import os
 import random
+import time
 
 from aioconsole import ainput
 
+from telegram.worker_pool import WorkerPool
+
+MATCH_TYPE_LABELS = {
+    'contains': 'Mengandung kata kunci',
+    'word': 'Kata utuh',
+    'prefix': 'Diawali kata kunci',
+    'exact': 'Sama persis',
+    'regex': 'Regex'
+}
+
 class AutoResponderMenu:
-    def __init__(self, rules_manager, client_manager, message_handler, db_manager):
+    def __init__(self, rules_manager, client_manager, message_handler, db_manager, worker_pool=None):
         self.rules_manager = rules_manager
         self.client_manager = client_manager
         self.message_handler = message_handler
         self.db_manager = db_manager
+        self.worker_pool = worker_pool
 
     async def auto_responder_menu(self):
         """UI for auto responder menu"""
@@ -65,6 +78,7 @@ class AutoResponderMenu:
         for rule_id, rule in rules.items():
             print(f"ID: {rule_id}")
             print(f"  Kata Kunci: {rule['keyword']}")
+            print(f"  Tipe Pencocokan: {MATCH_TYPE_LABELS.get(rule.get('match_type', 'contains'), 'Mengandung kata kunci')}")
             responses = rule.get('responses', [])
             if not responses and 'response' in rule:
                 responses = [rule['response']]
@@ -74,13 +88,29 @@ class AutoResponderMenu:
             print(f"  Hanya Private Chat: {'Ya' if rule.get('private_only', False) else 'Tidak'}")
             print()
 
+    async def _ask_match_type(self, allow_empty=False):
+        """Ask for a rule match type, returns None when left empty and allow_empty is set"""
+        match_types = list(MATCH_TYPE_LABELS.keys())
+        print("Tipe pencocokan:")
+        for i, match_type in enumerate(match_types, 1):
+            print(f"{i}. {MATCH_TYPE_LABELS[match_type]}")
+        choice = await ainput("Pilih tipe pencocokan (default: 1): " if not allow_empty else "Pilih tipe pencocokan: ")
+        if not choice.strip():
+            return None if allow_empty else 'contains'
+        try:
+            return match_types[int(choice) - 1]
+        except (ValueError, IndexError):
+            print("Pilihan tidak valid, menggunakan tipe default.")
+            return None if allow_empty else 'contains'
+
     async def add_rule(self):
         """UI for adding a new rule"""
         keyword = await ainput("Masukkan kata kunci/pola: ")
+        match_type = await self._ask_match_type()
         response = await ainput("Masukkan pesan balasan: ")
         private_only = await ainput("Hanya untuk private chat? (y/n): ")
         success, message = self.rules_manager.add_rule(
-            keyword, response, private_only.lower() == 'y'
+            keyword, response, private_only.lower() == 'y', match_type
         )
         print(message)
 
@@ -101,6 +131,7 @@ class AutoResponderMenu:
             return
         print(f"\nNilai saat ini:")
         print(f"Kata Kunci: {rule['keyword']}")
+        print(f"Tipe Pencocokan: {MATCH_TYPE_LABELS.get(rule.get('match_type', 'contains'), 'Mengandung kata kunci')}")
         responses = rule.get('responses', [])
         if not responses and 'response' in rule:
             response_main = rule['response']
@@ -110,6 +141,7 @@ class AutoResponderMenu:
         print(f"Hanya Private Chat: {'Ya' if rule.get('private_only', False) else 'Tidak'}")
         print("\nMasukkan nilai baru (kosongkan untuk menggunakan nilai saat ini):")
         new_keyword = await ainput("Kata kunci baru: ")
+        new_match_type = await self._ask_match_type(allow_empty=True)
         new_private_only = await ainput("Hanya private chat? (y/n): ")
         private_only = None
         if new_private_only.strip():
@@ -117,7 +149,8 @@ class AutoResponderMenu:
         success, message = self.rules_manager.update_rule(
             rule_id,
             keyword=new_keyword if new_keyword.strip() else None,
-            private_only=private_only
+            private_only=private_only,
+            match_type=new_match_type
         )
         print(message)
 
@@ -166,7 +199,7 @@ class AutoResponderMenu:
         if not self.rules_manager.get_all_rules():
             print("Tidak ada aturan auto responder yang tersimpan. Tambahkan aturan terlebih dahulu.")
             return
-        accounts = self.db_manager.get_all_accounts()
+        accounts = await self.db_manager.aget_all_accounts()
         if not accounts:
             print("Tidak ada akun yang tersimpan.")
             return
@@ -185,16 +218,27 @@ class AutoResponderMenu:
                 print("\nPilih akun untuk auto responder:")
                 for i, account in enumerate(accounts, 1):
                     print(f"{i}. {account[2]} ({account[6] if account[6] else 'Tidak ada nama'})")
-                account_choice = await ainput("Pilih nomor akun: ")
-                try:  # Tambahkan blok try-except
-                    account_index = int(account_choice) - 1
-                    if account_index < 0 or account_index >= len(accounts):
-                        print("Pilihan tidak valid!")
+                account_choice = (await ainput("Pilih nomor akun (atau phone/@username): ")).strip()
+                if account_choice.startswith(('+', '@')):
+                    # Langsung dicari lewat indeks, tanpa menelusuri daftar akun
+                    if account_choice.startswith('+'):
+                        account = await self.db_manager.aget_account_by_phone(account_choice)
+                    else:
+                        account = await self.db_manager.aget_account_by_username(account_choice)
+                    if not account:
+                        print(f"Akun {account_choice} tidak ditemukan!")
+                        return
+                    selected_accounts = [account]
+                else:
+                    try:  # Tambahkan blok try-except
+                        account_index = int(account_choice) - 1
+                        if account_index < 0 or account_index >= len(accounts):
+                            print("Pilihan tidak valid!")
+                            return
+                        selected_accounts = [accounts[account_index]]
+                    except ValueError:  # Tangkap kesalahan ValueError
+                        print("Input harus berupa angka!")
                         return
-                    selected_accounts = [accounts[account_index]]
-                except ValueError:  # Tangkap kesalahan ValueError
-                    print("Input harus berupa angka!")
-                    return
             elif option == 2:
                 selected_accounts = accounts
             elif option in [3, 4, 5]:
@@ -228,24 +272,39 @@ class AutoResponderMenu:
                     print("Waktu respons minimal 1 menit!")
                     return
                 total_delay_seconds = delay_minutes * 60
+                rate_limits = await self._configure_rate_limits()
+                chat_filters = await self._configure_chat_filters()
                 print(f"\nMenyiapkan {len(selected_accounts)} akun dengan estimasi waktu respons {delay_minutes} menit")
-                activated_count = 0
-                for account in selected_accounts:
-                    api_id, api_hash, phone = account[0], account[1], account[2]
-                    if phone in self.client_manager.active_clients:
-                        print(f"Auto responder untuk {phone} sudah berjalan!")
-                        continue
-                    client = await self.client_manager.create_client(api_id, api_hash, phone)
-                    if not await client.is_user_authorized():
-                        print(f"Akun {phone} belum diotorisasi. Silakan login terlebih dahulu.")
-                        await client.disconnect()
-                        continue
-                    variation = random.uniform(0.8, 1.2)
-                    account_delay = total_delay_seconds / len(selected_accounts) * variation
-                    self.message_handler.setup_handler(client, phone, account_delay)
-                    self.client_manager.add_active_client(phone, client)
-                    activated_count += 1
-                    await asyncio.sleep(0.2)
+                # 0 = tanpa batas: semua akun boleh tersambung bersamaan
+                max_connections = int(await self._ask_limit("Jumlah koneksi bersamaan", 20))
+                ramp_rate = await self._ask_limit("Akun yang mulai tersambung per detik", 10)
+                # Idle clients, including on-demand responders, are closed in LRU order to stay under the cap
+                connection_cap = await self._ask_limit("Batas koneksi terbuka seluruh akun",
+                                                       self.client_manager.max_open_connections or 0)
+                self.client_manager.max_open_connections = int(connection_cap) or None
+                cap = self.client_manager.max_open_connections
+                on_demand = False
+                if cap:
+                    print("\nMode koneksi:")
+                    print("1. Permanen, setiap akun tetap tersambung (default)")
+                    print("2. On-demand, akun tersambung saat ada pekerjaan dan yang paling lama idle diputus")
+                    on_demand = (await ainput("Pilih mode koneksi: ")).strip() == '2'
+                if not on_demand and cap and len(selected_accounts) + len(self.client_manager.active_clients) > cap:
+                    # Akun permanen memegang koneksinya terus, jadi akun di atas batas akan gagal
+                    print(f"Peringatan: batas koneksi {cap}, akun di atas batas tersebut tidak akan diaktifkan")
+                print("\nMode eksekusi:")
+                print("1. Satu proses (default)")
+                print("2. Worker pool multi-proses")
+                mode = await ainput("Pilih mode: ")
+                if mode == '2':
+                    activated_count = await self._activate_in_workers(
+                        selected_accounts, total_delay_seconds, max_connections, ramp_rate, rate_limits, on_demand,
+                        chat_filters
+                    )
+                else:
+                    activated_count = await self._activate_accounts(
+                        selected_accounts, total_delay_seconds, max_connections, ramp_rate, on_demand
+                    )
                 if activated_count > 0:
                     print(f"\n{activated_count} akun berhasil diaktifkan!")
                     print(f"Estimasi waktu respons: {delay_minutes} menit ({delay_minutes/60:.1f} jam)")
@@ -261,30 +320,192 @@ class AutoResponderMenu:
             logging.error(f"Gagal memulai auto responder: {str(e)}")
             print(f"Gagal memulai auto responder: {str(e)}")
 
+    async def _ask_limit(self, prompt, default):
+        """Ask for a numeric limit; empty keeps the default, 0 disables it"""
+        value = await ainput(f"{prompt} (default: {default}, 0 = tanpa batas): ")
+        if not value.strip():
+            return default
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            print("Input harus berupa angka, menggunakan nilai default.")
+            return default
+
+    async def _configure_rate_limits(self):
+        """UI for configuring token bucket limits of the responder"""
+        print("\nPengaturan batas kecepatan balasan:")
+        account_per_minute = await self._ask_limit("Maksimal balasan per akun per menit", 20)
+        chat_per_minute = await self._ask_limit("Maksimal balasan per chat per menit", 6)
+        global_per_second = await self._ask_limit("Maksimal balasan semua akun per detik", 30)
+        rate_limits = {
+            'global_rate': global_per_second or None,
+            'global_burst': max(int(global_per_second), 1),
+            'account_rate': account_per_minute / 60 or None,
+            'account_burst': 5,
+            'chat_rate': chat_per_minute / 60 or None,
+            'chat_burst': 2
+        }
+        self.message_handler.configure_rate_limits(**rate_limits)
+        return rate_limits
+
+    async def _ask_chat_ids(self, prompt, current):
+        """Ask for comma-separated chat IDs; empty keeps the current list, '-' clears it"""
+        shown = ', '.join(str(chat_id) for chat_id in sorted(current)) or '-'
+        value = (await ainput(f"{prompt} (saat ini: {shown}): ")).strip()
+        if not value:
+            return set(current)
+        if value == '-':
+            return set()
+        try:
+            return {int(part) for part in value.split(',') if part.strip()}
+        except ValueError:
+            print("ID chat harus berupa angka, daftar tidak diubah.")
+            return set(current)
+
+    async def _configure_chat_filters(self):
+        """UI for the chats the responder may or may not answer"""
+        print("\nFilter chat (ID chat dipisahkan koma, kosong = tetap, '-' = hapus):")
+        allowlist = await self._ask_chat_ids("Hanya balas chat", self.message_handler.chat_allowlist)
+        denylist = await self._ask_chat_ids("Jangan balas chat", self.message_handler.chat_denylist)
+        self.message_handler.set_chat_filters(allowlist, denylist)
+        return {'allowlist': sorted(allowlist), 'denylist': sorted(denylist)}
+
+    async def _activate_accounts(self, accounts, total_delay_seconds, max_connections, ramp_rate, on_demand=False):
+        """Activate accounts concurrently with a connection limit and ramp-up rate"""
+        pending = []
+        for account in accounts:
+            if account[2] in self.client_manager.active_clients or self._in_worker(account[2]):
+                print(f"Auto responder untuk {account[2]} sudah berjalan!")
+            else:
+                pending.append(account)
+        if not pending:
+            return 0
+        semaphore = asyncio.Semaphore(max_connections or len(pending))
+        interval = 1 / ramp_rate if ramp_rate else 0
+        start = time.monotonic()
+        tasks = []
+        for i, account in enumerate(pending):
+            variation = random.uniform(0.8, 1.2)
+            account_delay = total_delay_seconds / len(accounts) * variation
+            tasks.append(asyncio.create_task(
+                self.client_manager.activate_account(account, self.message_handler, account_delay, semaphore,
+                                                     start + i * interval, on_demand=on_demand)
+            ))
+        activated = failed = 0
+        failures = {}
+        try:
+            for future in asyncio.as_completed(tasks):
+                phone, reason = await future
+                if reason is None:
+                    activated += 1
+                else:
+                    failed += 1
+                    failures[phone] = reason
+                    logging.warning(f"Gagal mengaktifkan auto responder untuk {phone}: {reason}")
+                    print(f"\rAkun {phone} gagal: {reason}")
+                print(f"\rProgres: {activated + failed}/{len(pending)} (berhasil: {activated}, gagal: {failed})",
+                      end='', flush=True)
+        finally:
+            for task in tasks:
+                task.cancel()
+        print()
+        self._print_failures(failures)
+        return activated
+
+    def _print_failures(self, failures):
+        if failures:
+            print(f"\nRingkasan kegagalan ({len(failures)} akun):")
+            for phone, reason in failures.items():
+                print(f"- {phone}: {reason}")
+
+    def _in_worker(self, phone):
+        return self.worker_pool is not None and phone in self.worker_pool.assignments
+
+    async def _activate_in_workers(self, accounts, total_delay_seconds, max_connections, ramp_rate, rate_limits,
+                                   on_demand=False, chat_filters=None):
+        """Activate accounts on worker processes, each with its own event loop"""
+        pending = []
+        for account in accounts:
+            if account[2] in self.client_manager.active_clients or self._in_worker(account[2]):
+                print(f"Auto responder untuk {account[2]} sudah berjalan!")
+            else:
+                pending.append(account)
+        if not pending:
+            return 0
+        if self.worker_pool is None:
+            self.worker_pool = WorkerPool(self.rules_manager, client_manager=self.client_manager)
+        if not self.worker_pool.running:
+            default_workers = os.cpu_count() or 1
+            workers = int(await self._ask_limit("Jumlah worker proses", default_workers) or default_workers)
+            self.worker_pool.size = workers
+        print(f"Mengaktifkan {len(pending)} akun di {self.worker_pool.size} worker...")
+        results = await self.worker_pool.activate(pending, total_delay_seconds, max_connections, ramp_rate,
+                                                  rate_limits, self.client_manager.max_open_connections, on_demand,
+                                                  chat_filters)
+        failures = {phone: reason for phone, reason in results if reason is not None}
+        for phone, reason in failures.items():
+            logging.warning(f"Gagal mengaktifkan auto responder untuk {phone}: {reason}")
+        self._print_failures(failures)
+        return len(results) - len(failures)
+
+    async def shutdown_workers(self):
+        if self.worker_pool is not None:
+            await self.worker_pool.shutdown()
+
     async def stop_responder(self):
         """UI for stopping an auto responder"""
         active_clients = self.client_manager.active_clients
-        if not active_clients:
+        worker_stats = await self.worker_pool.stats() if self.worker_pool else []
+        worker_phones = [phone for stats in worker_stats for phone in stats['active']]
+        if not active_clients and not worker_phones:
             print("Tidak ada auto responder yang aktif!")
             return
         print("\nDaftar auto responder yang aktif:")
-        for i, phone in enumerate(active_clients.keys(), 1):
-            print(f"{i}. {phone}")
+        queue_stats = dict(self.message_handler.get_queue_stats())
+        for stats in worker_stats:
+            queue_stats.update(stats['queues'])
+        worker_of = {phone: stats['worker'] for stats in worker_stats for phone in stats['active']}
+        phones = list(active_clients.keys()) + worker_phones
+        for i, phone in enumerate(phones, 1):
+            stats = queue_stats.get(phone)
+            where = f" [worker {worker_of[phone]}]" if phone in worker_of else ""
+            if stats:
+                shed = stats['dropped_newest'] + stats['dropped_oldest']
+                print(f"{i}. {phone}{where} (antrean: {stats['pending']}, dibuang: {shed}, "
+                      f"digabung: {stats['coalesced']})")
+            else:
+                print(f"{i}. {phone}{where}")
+        backlog = self.message_handler.get_scheduler_backlog()
+        print(f"Jadwal balasan tertunda: {backlog['scheduled']} (sedang dikirim: {backlog['running']})")
+        rate_stats = self.message_handler.get_rate_stats()
+        for phone, seconds in rate_stats['paused_accounts'].items():
+            print(f"Akun {phone} dijeda {seconds} detik karena FloodWait")
+        for stats in worker_stats:
+            print(f"Worker {stats['worker']} (pid {stats['pid']}): {len(stats['active'])} akun, "
+                  f"jadwal tertunda: {stats['backlog']['scheduled']}, lag loop: {stats['loop_lag_ms']} ms "
+                  f"(maks {stats['max_loop_lag_ms']} ms)")
+            for phone, seconds in stats['rate']['paused_accounts'].items():
+                print(f"Akun {phone} dijeda {seconds} detik karena FloodWait")
         choice = await ainput("Pilih nomor auto responder yang akan dihentikan (0 untuk semua): ")
         try:
             if choice == '0':
                 for phone in list(active_clients.keys()):
                     await self.client_manager.disconnect_client(phone)
                     self.message_handler.remove_handler(phone)
+                if worker_phones:
+                    await self.worker_pool.stop_accounts()
                 print("Semua auto responder berhasil dihentikan!")
             else:
                 choice_idx = int(choice) - 1
-                if choice_idx < 0 or choice_idx >= len(active_clients):
+                if choice_idx < 0 or choice_idx >= len(phones):
                     print("Pilihan tidak valid!")
                     return
-                phone = list(active_clients.keys())[choice_idx]
-                await self.client_manager.disconnect_client(phone)
-                self.message_handler.remove_handler(phone)
+                phone = phones[choice_idx]
+                if phone in worker_of:
+                    await self.worker_pool.stop_accounts([phone])
+                else:
+                    await self.client_manager.disconnect_client(phone)
+                    self.message_handler.remove_handler(phone)
                 print(f"Auto responder untuk {phone} berhasil dihentikan!")
         except ValueError:
             print("Input harus berupa angka!")
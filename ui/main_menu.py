@@ -37,7 +37,7 @@ class MainMenu:
             if choice == '1':
                 await self.account_manager.add_account()
             elif choice == '2':
-                self.account_manager.list_accounts()
+                await self.account_manager.list_accounts()
             elif choice == '3':
                 await self.account_manager.test_connection()
             elif choice == '4':
@@ -9,9 +9,12 @@ from aioconsole import ainput
 from prettytable import PrettyTable
 
 class StatusMenu:
-    def __init__(self, db_manager, client_manager):
+    def __init__(self, db_manager, client_manager, supervisor=None, health_monitor=None, worker_pool=None):
         self.db_manager = db_manager
         self.client_manager = client_manager
+        self.supervisor = supervisor
+        self.health_monitor = health_monitor
+        self.worker_pool = worker_pool
         self.start_time = datetime.now()
         self.status_log_file = 'status_history.json'
         self.status_history = self._load_status_history()
@@ -73,6 +76,19 @@ class StatusMenu:
             else:
                 print("Pilihan tidak valid!")
 
+    async def _worker_stats(self):
+        """Stats of every worker process; accounts running there are not in client_manager"""
+        if self.worker_pool is None:
+            return []
+        try:
+            return await self.worker_pool.stats()
+        except Exception as e:
+            logging.error(f"Error getting worker stats: {str(e)}")
+            return []
+
+    def _count_active_clients(self, worker_stats):
+        return len(self.client_manager.active_clients) + sum(len(stats['active']) for stats in worker_stats)
+
     async def view_system_status(self):
         """Display system status including uptime and active components"""
         # Calculate uptime
@@ -80,16 +96,14 @@ class StatusMenu:
         uptime_str = str(uptime).split('.')[0]  # Remove microseconds
         
         # Get account and client statistics
-        total_accounts = len(self.db_manager.get_all_accounts())
-        active_clients = len(self.client_manager.active_clients)
+        total_accounts = await self.db_manager.acount_accounts()
+        worker_stats = await self._worker_stats()
+        active_clients = self._count_active_clients(worker_stats)
         
         # Get database info
         try:
-            conn, cursor = self.db_manager.get_connection()
-            cursor.execute("PRAGMA page_count")
-            page_count = cursor.fetchone()[0]
-            cursor.execute("PRAGMA page_size")
-            page_size = cursor.fetchone()[0]
+            page_count = await self.db_manager.apragma("page_count")
+            page_size = await self.db_manager.apragma("page_size")
             db_size = page_count * page_size / (1024 * 1024)  # Size in MB
         except Exception as e:
             logging.error(f"Error getting database info: {str(e)}")
@@ -105,6 +119,13 @@ class StatusMenu:
         print(f"Uptime: {uptime_str}")
         print(f"Total Accounts: {total_accounts}")
         print(f"Active Clients: {active_clients}")
+        connections = self.client_manager.connection_stats()
+        print(f"Open Connections: {connections['open']} (busy: {connections['busy']}, idle: {connections['idle']}, "
+              f"cap: {connections['cap'] or 'unlimited'}, evicted: {connections['evictions']})")
+        for stats in worker_stats:
+            worker_connections = stats['connections']
+            print(f"Worker {stats['worker']}: {len(stats['active'])} active, {worker_connections['open']} open "
+                  f"(cap: {worker_connections['cap'] or 'unlimited'})")
         print(f"Session Files: {session_count}")
         print(f"Database Size: {db_size:.2f} MB")
         print(f"Status Records: {len(self.status_history)}")
@@ -136,9 +157,7 @@ class StatusMenu:
         """Check database integrity"""
         print("\nMemeriksa integritas database...")
         try:
-            conn, cursor = self.db_manager.get_connection()
-            cursor.execute("PRAGMA integrity_check")
-            result = cursor.fetchone()[0]
+            result = await self.db_manager.apragma("integrity_check")
             
             if result == "ok":
                 print("✅ Database integrity check passed")
@@ -146,11 +165,9 @@ class StatusMenu:
                 print(f"⚠️ Database integrity issues found: {result}")
                 
             # Check for database optimizations
-            cursor.execute("PRAGMA auto_vacuum")
-            auto_vacuum = cursor.fetchone()[0]
+            auto_vacuum = await self.db_manager.apragma("auto_vacuum")
             
-            cursor.execute("PRAGMA journal_mode")
-            journal_mode = cursor.fetchone()[0]
+            journal_mode = await self.db_manager.apragma("journal_mode")
             
             print(f"\nDatabase settings:")
             print(f"Auto Vacuum: {auto_vacuum}")
@@ -160,6 +177,13 @@ class StatusMenu:
                 print("⚠️ Consider enabling auto_vacuum to reduce database size over time")
             if journal_mode.lower() != "wal":
                 print("⚠️ Consider using WAL journal mode for better performance")
+            
+            # Hot lookups must be served by an index, never by a full table scan
+            schema_version = await self.db_manager.apragma("user_version")
+            print(f"Schema Version: {schema_version}")
+            print("\nQuery plans:")
+            for plan in await self.db_manager.acheck_query_plans():
+                print(f"{'⚠️' if plan['full_scan'] else '✅'} {plan['query']}: {plan['plan']}")
         except Exception as e:
             logging.error(f"Error checking database integrity: {str(e)}")
             print(f"Error checking database: {str(e)}")
@@ -214,7 +238,7 @@ class StatusMenu:
 
     async def view_account_statistics(self):
         """Display account statistics using a table"""
-        accounts = self.db_manager.get_all_accounts()
+        accounts = await self.db_manager.aget_all_accounts()
         if not accounts:
             print("Tidak ada data akun untuk ditampilkan.")
             return
@@ -255,13 +279,23 @@ class StatusMenu:
 
     async def _search_account(self):
         """Search for specific account"""
-        search_term = await ainput("Masukkan kata kunci pencarian (phone/username/name): ")
+        search_term = await ainput("Masukkan kata kunci pencarian (phone/username/name/user ID): ")
         if not search_term.strip():
             return
         
-        accounts = self.db_manager.get_all_accounts()
-        results = []
+        # Exact phone, @username or user ID matches come straight from the indexed lookups
+        term = search_term.strip()
+        if term.startswith('+'):
+            exact = await self.db_manager.aget_account_by_phone(term)
+        elif term.startswith('@'):
+            exact = await self.db_manager.aget_account_by_username(term)
+        elif term.isdigit() and int(term) > 0:
+            exact = await self.db_manager.aget_account_by_user_id(term)
+        else:
+            exact = None
+        results = [exact] if exact else []
         
+        accounts = [] if exact else await self.db_manager.aget_all_accounts()
         for row in accounts:
             # Search in phone, username, and name
             if (search_term.lower() in str(row[2]).lower() or  # phone
@@ -304,7 +338,7 @@ class StatusMenu:
             print("Pilihan tidak valid!")
             return
         
-        accounts = self.db_manager.get_all_accounts()
+        accounts = await self.db_manager.aget_all_accounts()
         
         # Sort accounts
         # Handle None values in sort
@@ -322,7 +356,7 @@ class StatusMenu:
 
     async def _view_account_distribution(self):
         """View account distribution by username presence"""
-        accounts = self.db_manager.get_all_accounts()
+        accounts = await self.db_manager.aget_all_accounts()
         
         # Count accounts with/without username
         with_username = 0
@@ -350,59 +384,98 @@ class StatusMenu:
     async def view_active_clients(self):
         """Display information about active clients"""
         active_clients = self.client_manager.active_clients
+        worker_stats = await self._worker_stats()
         
-        if not active_clients:
+        if not active_clients and not any(stats['active'] for stats in worker_stats):
             print("Tidak ada klien aktif saat ini.")
             return
         
-        print(f"\n--- Active Clients ({len(active_clients)}) ---")
+        print(f"\n--- Active Clients ({self._count_active_clients(worker_stats)}) ---")
         
         # Get account info for active clients
         client_info = []
         for phone, client in active_clients.items():
             # Find account info
-            account_info = None
-            accounts = self.db_manager.get_all_accounts()
-            for account in accounts:
-                if account[2] == phone:  # Match by phone
-                    account_info = account
-                    break
-            
-            # Check connection status
+            account_info = await self.db_manager.aget_account_by_phone(phone)
+            
+            # Check connection status; RTT and errors come from the background pings
             is_connected = False
-            user_id = None
-            username = None
             try:
                 is_connected = client.is_connected()
-                if is_connected:
-                    # This would be async but we're simplifying for this example
-                    pass
             except Exception as e:
                 logging.error(f"Error checking client connection for {phone}: {str(e)}")
+            health = self.health_monitor.summary(phone) if self.health_monitor else None
             
+            reconnect_attempt = self.supervisor.status(phone) if self.supervisor else None
+
             client_info.append({
                 'phone': phone,
+                'process': "utama",
                 'connected': is_connected,
+                'reconnect_attempt': reconnect_attempt,
+                'health': health,
                 'api_id': account_info[0] if account_info else None,
                 'username': account_info[5] if account_info else None,
                 'name': account_info[6] if account_info else None
             })
         
+        # Worker accounts are reported by their own process
+        for stats in worker_stats:
+            for phone in stats['active']:
+                account_info = await self.db_manager.aget_account_by_phone(phone)
+                client_info.append({
+                    'phone': phone,
+                    'process': f"worker {stats['worker']}",
+                    'connected': phone in stats['connected'],
+                    'reconnect_attempt': stats['reconnects']['reconnecting'].get(phone),
+                    'health': stats['health'].get(phone),
+                    'api_id': account_info[0] if account_info else None,
+                    'username': account_info[5] if account_info else None,
+                    'name': account_info[6] if account_info else None
+                })
+        
         # Display clients in table
         table = PrettyTable()
-        table.field_names = ["Phone", "Connected", "API ID", "Username", "Name"]
+        table.field_names = ["Phone", "Process", "Connected", "API ID", "Username", "Name", "RTT (ms)", "p95 (ms)",
+                             "Errors", "Last Seen"]
         
         for info in client_info:
+            if info['connected']:
+                connected = "✅"
+            elif info['reconnect_attempt']:
+                connected = f"🔄 (percobaan {info['reconnect_attempt']})"
+            else:
+                connected = "❌"
             table.add_row([
                 info['phone'],
-                "✅" if info['connected'] else "❌",
+                info['process'],
+                connected,
                 info['api_id'],
                 info['username'],
-                info['name']
+                info['name'],
+                *self._health_columns(info['health'])
             ])
         
         print(table)
         
+        if worker_stats:
+            print("\nWorker Processes:")
+            worker_table = PrettyTable()
+            worker_table.field_names = ["Worker", "PID", "Accounts", "Open", "Cap", "Reconnects", "Cached Peers",
+                                        "Loop Lag (ms)"]
+            for stats in worker_stats:
+                worker_table.add_row([
+                    stats['worker'],
+                    stats['pid'],
+                    len(stats['active']),
+                    stats['connections']['open'],
+                    stats['connections']['cap'] or "-",
+                    sum(stats['reconnects']['reconnects'].values()),
+                    stats['entity_cache']['peers'],
+                    stats['loop_lag_ms']
+                ])
+            print(worker_table)
+        
         # Show options for active clients
         print("\nOptions:")
         print("1. Disconnect Client")
@@ -415,6 +488,17 @@ class StatusMenu:
         elif choice == '2':
             await self._disconnect_all_clients()
 
+    def _health_columns(self, health):
+        """RTT, p95, error count and last-seen columns for one client"""
+        if not health:
+            return ["-", "-", "-", "-"]
+        last_seen = datetime.fromtimestamp(health['last_seen']).strftime('%H:%M:%S') if health['last_seen'] else "-"
+        errors = str(health['errors'])
+        if health['last_error']:
+            errors += f" ({health['last_error']})"
+        return [health['last_rtt_ms'] if health['last_rtt_ms'] is not None else "-",
+                health['p95_ms'] if health['p95_ms'] is not None else "-", errors, last_seen]
+
     async def _disconnect_client(self):
         """Disconnect a specific client"""
         active_clients = self.client_manager.active_clients
@@ -644,21 +728,16 @@ class StatusMenu:
         
         # Check database
         try:
-            conn, cursor = self.db_manager.get_connection()
-            
             # Check if database is locked
             try:
-                cursor.execute("BEGIN IMMEDIATE")
-                cursor.execute("COMMIT")
+                await self.db_manager.acheck_writable()
                 print("✅ Database: Available (not locked)")
             except Exception as e:
                 print(f"⚠️ Database: Locked or busy ({str(e)})")
             
             # Check database size
-            cursor.execute("PRAGMA page_count")
-            page_count = cursor.fetchone()[0]
-            cursor.execute("PRAGMA page_size")
-            page_size = cursor.fetchone()[0]
+            page_count = await self.db_manager.apragma("page_count")
+            page_size = await self.db_manager.apragma("page_size")
             db_size = page_count * page_size / (1024 * 1024)  # Size in MB
             
             db_status = "Normal"
@@ -668,8 +747,7 @@ class StatusMenu:
             print(f"✅ Database Size: {db_size:.2f} MB ({db_status})")
             
             # Check database integrity
-            cursor.execute("PRAGMA quick_check")
-            integrity = cursor.fetchone()[0]
+            integrity = await self.db_manager.apragma("quick_check")
             if integrity == "ok":
                 print("✅ Database Integrity: Good")
             else:
@@ -678,10 +756,21 @@ class StatusMenu:
             logging.error(f"Database check error: {str(e)}")
             print(f"❌ Database Check: Error ({str(e)})")
         
-        # Check active clients
-        active_clients = len(self.client_manager.active_clients)
+        # Check active clients, including the ones running in worker processes
+        worker_stats = await self._worker_stats()
+        active_clients = self._count_active_clients(worker_stats)
         print(f"✅ Active Clients: {active_clients}")
-        
+        for stats in worker_stats:
+            disconnected = len(stats['active']) - len(stats['connected'])
+            icon = '✅' if not disconnected else '⚠️'
+            print(f"{icon} Worker {stats['worker']}: {len(stats['active'])} active, {disconnected} disconnected, "
+                  f"loop lag {stats['loop_lag_ms']} ms")
+
+        # Optionally probe every stored account with lightweight clients
+        choice = await ainput("Uji koneksi semua akun? (y/n): ")
+        if choice.lower() == 'y':
+            await self._probe_all_accounts()
+
         # Check disk space
         try:
             total, used, free = shutil.disk_usage('/')
@@ -724,14 +813,33 @@ class StatusMenu:
         # Overall health assessment
         print("\nOverall System Health: Good")
 
+    async def _probe_all_accounts(self):
+        """Probe all accounts with probe clients and summarize the results"""
+        accounts = await self.db_manager.aget_all_accounts()
+        if not accounts:
+            print("⚠️ Accounts: Tidak ada akun untuk diuji")
+            return
+        counts = {}
+        async for account, result in self.client_manager.probe_accounts(accounts):
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            print(f"\r  Diuji: {sum(counts.values())}/{len(accounts)}", end='', flush=True)
+        print()
+        failed = len(accounts) - counts.get('Berhasil', 0) - counts.get('Dilewati', 0)
+        summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+        print(f"{'✅' if not failed else '⚠️'} Account Connections: {summary}")
+
     async def export_status_report(self):
         """Export a comprehensive status report"""
         # Collect current status
         uptime = datetime.now() - self.start_time
         uptime_str = str(uptime).split('.')[0]
         
-        total_accounts = len(self.db_manager.get_all_accounts())
-        active_clients = len(self.client_manager.active_clients)
+        total_accounts = await self.db_manager.acount_accounts()
+        worker_stats = await self._worker_stats()
+        active_clients = self._count_active_clients(worker_stats)
+        client_health = self.health_monitor.all_summaries() if self.health_monitor else {}
+        for stats in worker_stats:
+            client_health.update(stats['health'])
         
         # Generate report data
         report = {
@@ -747,7 +855,20 @@ class StatusMenu:
             "history": {
                 "status_records": len(self.status_history),
                 "recent_changes": []
-            }
+            },
+            "client_health": client_health,
+            "workers": [
+                {
+                    "worker": stats['worker'],
+                    "pid": stats['pid'],
+                    "active": stats['active'],
+                    "connections": stats['connections'],
+                    "reconnects": stats['reconnects'],
+                    "entity_cache": stats['entity_cache'],
+                    "loop_lag_ms": stats['loop_lag_ms']
+                }
+                for stats in worker_stats
+            ]
         }
         
         # Add recent changes if available
@@ -798,6 +919,20 @@ class StatusMenu:
                     f.write(f"Total Accounts: {total_accounts}\n")
                     f.write(f"Active Clients: {active_clients}\n")
                     
+                    if report["workers"]:
+                        f.write("\nWORKER PROCESSES\n")
+                        for worker in report["workers"]:
+                            f.write(f"Worker {worker['worker']} (pid {worker['pid']}): {len(worker['active'])} active, "
+                                    f"{worker['connections']['open']} open connections, "
+                                    f"{sum(worker['reconnects']['reconnects'].values())} reconnects, "
+                                    f"{worker['entity_cache']['peers']} cached peers\n")
+
+                    if report["client_health"]:
+                        f.write("\nCLIENT HEALTH\n")
+                        for phone, health in report["client_health"].items():
+                            f.write(f"{phone}: RTT {health['last_rtt_ms']} ms (avg {health['avg_rtt_ms']}, "
+                                    f"p95 {health['p95_ms']}), pings {health['pings']}, errors {health['errors']}\n")
+
                     if "recent_changes" in report["history"]:
                         f.write("\nRECENT CHANGES\n")
                         changes = report["history"]["recent_changes"]
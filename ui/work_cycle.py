@@ -224,7 +224,7 @@ class WorkCycleMenu:
             
             elif task.action_type == 'status_update':
                 if self.client_manager and self.db_manager:
-                    total_accounts = len(self.db_manager.get_all_accounts())
+                    total_accounts = await self.db_manager.acount_accounts()
                     active_clients = len(self.client_manager.active_clients)
                     print(f"[STATUS] Total Accounts: {total_accounts}, Active Clients: {active_clients}")
                     return True